@@ -0,0 +1,200 @@
+# MIT License
+#
+# Copyright (c) 2023 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from container_workflow_tool.utility import setup_logger, _get_cache_dir
+
+
+class KojiCache:
+    """Persistent SQLite cache of koji hub responses."""
+
+    def __init__(self, path=None, logger=None):
+        """
+        Args:
+            path (str, optional): Path to the database file, defaults to
+                                  koji.sqlite in the user cache directory
+            logger (Logger, optional): Logger to be used
+        """
+        self._path = path
+        self._db = None
+        self._lock = threading.Lock()
+        self.logger = logger if logger else setup_logger("koji-cache")
+        # Responses of different hubs are kept apart
+        self.namespace = ""
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def path(self):
+        # Resolved lazily so the cache directory is not created needlessly
+        if self._path is None:
+            self._path = os.path.join(_get_cache_dir(), "koji.sqlite")
+        return self._path
+
+    @property
+    def db(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses "
+                             "(key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS snapshots "
+                             "(key TEXT PRIMARY KEY, event INTEGER, value TEXT)")
+        return self._db
+
+    def _key(self, method, params):
+        return json.dumps([self.namespace, method, list(params)], default=str)
+
+    def get(self, method, params):
+        """Returns the cached response of a hub call
+
+        Args:
+            method (str): Name of the hub method
+            params (tuple): Arguments of the call
+
+        Returns:
+            Cached response or None if it is not cached or has expired
+        """
+        with self._lock:
+            row = self.db.execute("SELECT value, expires FROM responses WHERE key = ?",
+                                  (self._key(method, params),)).fetchone()
+            if row is None or (row[1] is not None and row[1] < time.time()):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, method, params, value, ttl=None):
+        """Stores the response of a hub call
+
+        Args:
+            method (str): Name of the hub method
+            params (tuple): Arguments of the call
+            value: Response to be stored
+            ttl (int, optional): Seconds until the entry expires, never if None
+        """
+        expires = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                            (self._key(method, params), json.dumps(value, default=str), expires))
+            self.db.commit()
+
+    def get_snapshot(self, name):
+        """Returns a snapshot stored by set_snapshot
+
+        Args:
+            name (str): Identifier of the snapshot
+
+        Returns:
+            (int, object): Hub event ID and the snapshot data, None if there is no snapshot
+        """
+        with self._lock:
+            row = self.db.execute("SELECT event, value FROM snapshots WHERE key = ?",
+                                  (self._key("snapshot", (name,)),)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def set_snapshot(self, name, event, value):
+        """Stores data valid at the given hub event
+
+        Args:
+            name (str): Identifier of the snapshot
+            event (int): Hub event ID the data corresponds to
+            value: Snapshot data
+        """
+        with self._lock:
+            self.db.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)",
+                            (self._key("snapshot", (name,)), event, json.dumps(value, default=str)))
+            self.db.commit()
+
+    def purge(self):
+        """Removes all the cached responses"""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+            if os.path.exists(self.path):
+                self.logger.debug("Removing koji cache " + self.path)
+                os.remove(self.path)
+            self.hits = self.misses = 0
+
+    def report(self):
+        """Logs the hit and miss counters"""
+        msg = "Koji cache: {} hits, {} misses"
+        self.logger.debug(msg.format(self.hits, self.misses))
+
+
+class BuildHistory:
+    """Persistent SQLite store of build durations."""
+
+    # Number of latest builds of a component the expected duration is computed from
+    samples = 5
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path (str, optional): Path to the database file, defaults to
+                                  builds.sqlite in the user cache directory
+        """
+        self._path = path
+        self._db = None
+
+    @property
+    def path(self):
+        if self._path is None:
+            self._path = os.path.join(_get_cache_dir(), "builds.sqlite")
+        return self._path
+
+    @property
+    def db(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(self.path)
+            self._db.execute("CREATE TABLE IF NOT EXISTS durations "
+                             "(component TEXT, seconds REAL, recorded REAL)")
+        return self._db
+
+    def record(self, component, seconds):
+        """Stores the duration of a successful build"""
+        self.db.execute("INSERT INTO durations VALUES (?, ?, ?)", (component, seconds, time.time()))
+        self.db.commit()
+
+    def get_durations(self, components):
+        """Returns expected build durations
+
+        Args:
+            components (list): Components to look up
+
+        Returns:
+            dict: Average duration of the latest builds for every component with a recorded build
+        """
+        durations = {}
+        for component in components:
+            rows = self.db.execute("SELECT seconds FROM durations WHERE component = ? "
+                                   "ORDER BY recorded DESC LIMIT ?", (component, self.samples)).fetchall()
+            if rows:
+                durations[component] = sum(row[0] for row in rows) / len(rows)
+        return durations
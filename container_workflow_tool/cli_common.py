@@ -1,7 +1,7 @@
 import sys
 import os
 
-from container_workflow_tool.utility import ArgParser
+from container_workflow_tool.utility import ArgParser, _non_negative_int
 from container_workflow_tool.constants import actions
 
 
@@ -23,7 +23,8 @@ class CliCommon(object):
         parser.add_argument('--config',
                             help='Overrides default configuration file, expects the name of file a inside the config folder without .yml, ie rhscl230')
         parser.add_argument('--tmp', help='Overrides default temporary working directory')
-        parser.add_argument('--clear-cache', action='store_true', help='Clears tmp dir before running the command')
+        parser.add_argument('--clear-cache', action='store_true',
+                            help='Clears tmp dir and koji cache before running the command')
         parser.add_argument('--latest-release', action='store_true',
                             help='Work with latest brew builds by release value')
         parser.add_argument('--do-image',
@@ -59,9 +60,37 @@ class CliCommon(object):
         parsers['git'].add_argument('--rebuild-reason', help='Use a custom reason for rebuilding')
         parsers['git'].add_argument('--commit-msg', help='Use a custom message instead of the default one')
         parsers['git'].add_argument('--check-script', help='Script/command to be run when checking repositories')
+        parsers['git'].add_argument('--update-downstreams', action='store_true', default=None,
+                                    help='Fetch and fast-forward existing downstream repositories')
+        parsers['git'].add_argument('--upstream-depth', type=int,
+                                    help='Clone upstream repositories with this history depth (0 is full history)')
+        parsers['git'].add_argument('--upstream-filter',
+                                    help='Partial clone filter of upstream repositories, e.g. blob:none')
+        parsers['git'].add_argument('--upstream-sparse', action='store_true', default=None,
+                                    help='Check out only the synced directories of upstream repositories')
+        parsers['koji'].add_argument('--since-last', action='store_true',
+                                     help='List only builds that changed since the last run')
+        parsers['koji'].add_argument('--output-format', choices=['json', 'csv'],
+                                     help='Format of machine readable output, default json')
         parsers['build'].add_argument(
             '--repo-url', help='Set the url of a .repo file to be used when building the image'
         )
+        parsers['build'].add_argument(
+            '--max-parallel-builds', type=_non_negative_int,
+            help='Maximum number of builds running at once, overrides the config value (0 is unlimited)'
+        )
+        parsers['build'].add_argument(
+            '--skip-unchanged', action='store_true',
+            help='Do not build images whose dist-git HEAD was already built in koji'
+        )
+        parsers['build'].add_argument(
+            '--resume', action='store_true',
+            help='Continue the previous build run, skipping finished builds and watching submitted ones'
+        )
+        parsers['build'].add_argument(
+            '--nowait', action='store_true',
+            help='Do not keep a packager process per build, watch the submitted koji tasks instead'
+        )
         return parser
 
     def cli_usage(self):
@@ -75,7 +104,7 @@ class CliCommon(object):
     Options:
         -v, --verbosity      - Verbosity level, 1 (Critical only) - 5 (Debug messages), default 4 (Info)
         --base               - Specific base image release, required for some actions
-        --clear-cache        - Clears tmp dir before running the command
+        --clear-cache        - Clears tmp dir and koji cache before running the command
         --latest-release     - Work with latest brew builds by release value
         --config             - Overrides default configuration file,
                                expects the name of file a inside the config folder, optionally takes image_set argument
@@ -103,9 +132,14 @@ class CliCommon(object):
         show             - Walk trough git repositories and show changes for each
 
     Options:
-        --commit-msg     - Use a custom message instead of the default one
-        --rebuild-reason - Use a custom reason for rebuilding
-        --check-script   - Script/command to be run when checking repositories
+        --commit-msg         - Use a custom message instead of the default one
+        --rebuild-reason     - Use a custom reason for rebuilding
+        --check-script       - Script/command to be run when checking repositories
+        --update-downstreams - Fetch and fast-forward existing downstream repositories
+        --upstream-depth     - Clone upstream repositories with this history depth (0 is full history)
+        --upstream-filter    - Partial clone filter of upstream repositories, e.g. blob:none
+        --upstream-sparse    - Check out only the synced directories of upstream repositories
+                               and the directories their symlinks point to
     """
         return action_help
 
@@ -113,6 +147,12 @@ class CliCommon(object):
         action_help = """%s koji action
     Action:%s
         latestbuilds - Query koji and list latest builds of images
+        latestbase   - Query koji and check whether latest builds use the latest base images
+        hashids      - Query koji and list hash ids of latest builds for all architectures
+
+    Options:
+        --since-last    - List only builds that changed since the last run (latestbuilds)
+        --output-format - Format of machine readable output, json (default) or csv (hashids)
     """
         return action_help
 
@@ -120,7 +160,14 @@ class CliCommon(object):
         action_help = """%s build image_set
     image_set       - ID of the image set to be built. Sets can be defined in the config file
     Options:
-        --repo-url  - Set the url of a .repo file to be used when building the image
+        --repo-url            - Set the url of a .repo file to be used when building the image
+        --max-parallel-builds - Maximum number of builds running at once, overrides the config value
+                                (0 is unlimited)
+        --skip-unchanged      - Do not build images whose dist-git HEAD was already built in koji
+        --resume              - Continue the previous build run, skipping finished builds
+                                and watching the koji tasks of submitted ones
+        --nowait              - Do not keep a packager process per build, watch the submitted
+                                koji tasks instead
     """
         return action_help % self.prg_name
 
@@ -129,6 +176,8 @@ class CliCommon(object):
     Action:%s
         listimages   - List all images (names in repo without namespace) that we work with
         listupstream - Print information about images' upstream repository
+        buildgraph   - Print the images each image is built from (read from cloned Dockerfiles)
+                       and the longest chain of dependent builds
         showconfig   - Print the contents of the configuration file used
     """
         return action_help
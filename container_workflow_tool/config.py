@@ -6,6 +6,8 @@ import os
 
 import yaml
 
+from container_workflow_tool.utility import RebuilderError
+
 
 class Loader(yaml.SafeLoader):
     """YAML Loader with `!include` constructor."""
@@ -78,6 +80,24 @@ class Config(dict):
         self["groups"] = config.get("groups", {})
         self["mails"] = config.get("mails", {})
         self["df_ext"] = config.get("df_ext", ".fedora")
+        self["max_parallel_builds"] = config.get("max_parallel_builds", 0)
+        if not isinstance(self["max_parallel_builds"], int) or self["max_parallel_builds"] < 0:
+            msg = "max_parallel_builds must be a non-negative integer (0 is unlimited), got {!r}"
+            raise RebuilderError(msg.format(self["max_parallel_builds"]))
+        self["clone_workers"] = config.get("clone_workers", 8)
+        self["update_downstreams"] = config.get("update_downstreams", False)
+        self["mirror_upstreams"] = config.get("mirror_upstreams", True)
+        self["upstream_depth"] = config.get("upstream_depth", 0)
+        self["upstream_filter"] = config.get("upstream_filter", "")
+        self["upstream_sparse"] = config.get("upstream_sparse", False)
+        self["build_max_attempts"] = config.get("build_max_attempts", 3)
+        self["build_retry_delay"] = config.get("build_retry_delay", 60)
+        self["build_retry_patterns"] = config.get("build_retry_patterns", [])
+        self["koji_url"] = config.get("koji_url", "https://koji.fedoraproject.org/kojihub")
+        self["koji_timeout"] = config.get("koji_timeout", 120)
+        self["koji_multicall_size"] = config.get("koji_multicall_size", 50)
+        self["koji_workers"] = config.get("koji_workers", 4)
+        self["koji_cache_ttl"] = config.get("koji_cache_ttl", 300)
         self["raw"] = config
         commands = config.get("commands", {})
         # Parse the image layers
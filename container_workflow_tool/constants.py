@@ -24,11 +24,12 @@ action_map['koji']['hashids'] = 'print_hash_ids'
 action_map['git']['diff'] = 'check_downstream_diffs'
 action_map['utils']['setuprepo'] = 'setup_repo_file'
 action_map['utils']['notifymail'] = 'print_email_notification'
+action_map['utils']['buildgraph'] = 'print_build_graph'
 
 actions = {}
 actions['git'] = ['pullupstream', 'clonedownstream', 'cloneupstream',
                   'rebase', 'merge', 'show', 'push', ]
-actions['koji'] = ['latestbuilds', ]
-actions['utils'] = ['showconfig', 'listimages', 'listupstream', ]
+actions['koji'] = ['latestbuilds', 'latestbase', 'hashids', ]
+actions['utils'] = ['showconfig', 'listimages', 'listupstream', 'buildgraph', ]
 
 COMMAND = ""
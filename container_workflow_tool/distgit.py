@@ -1,9 +1,10 @@
 import os
 import shutil
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 from git import Repo
-from git.exc import GitCommandError
+from git.exc import GitCommandError, GitError
 
 from container_workflow_tool import utility
 from container_workflow_tool.utility import RebuilderError
@@ -63,16 +64,20 @@ class DistgitAPI(GitOperations):
             images (list): List of images to sync
             rebase (bool, optional): Specify if a rebase should be done instead
         """
+        repos = self.clone_downstreams(images)
+        ups_paths = self.get_upstream_paths(images)
         try:
             for image in images:
                 name = image["name"]
                 component = image["component"]
-                branch = image["git_branch"]
                 path = image["git_path"]
                 url = image["git_url"]
                 commands = image["commands"]
                 pull_upstr = image.get("pull_upstream", True)
-                repo = self._clone_downstream(component, branch)
+                if component not in repos:
+                    # The clone failure has been reported already
+                    continue
+                repo = repos[component]
                 df_path = os.path.join(component, "Dockerfile")
                 downstream_from = self.df_handler.get_from_df(df_path)
                 self.logger.debug(f"Downstream_from: {downstream_from}\n")
@@ -93,7 +98,7 @@ class DistgitAPI(GitOperations):
                     ups_name = name.split('-')[0]
                     # Clone upstream repository
                     ups_path = os.path.join('upstreams/', ups_name)
-                    self.clone_upstream(url, ups_path, commands=commands)
+                    self.clone_upstream(url, ups_path, commands=commands, paths=ups_paths[ups_name])
                     # Save the upstream commit hash
                     ups_hash = Repo(ups_path).commit().hexsha
                     self.pull_upstream(component, path, url, repo, ups_name, commands)
@@ -114,12 +119,110 @@ class DistgitAPI(GitOperations):
         finally:
             # Cleanup upstream repos
             shutil.rmtree("upstreams", ignore_errors=True)
+            self.forget_upstreams()
+
+    def clone_downstreams(self, images, update=None):
+        """Clones downstream dist-git repos of images in parallel
+
+        Existing repositories are reused, with update set their branches are
+        fetched and fast-forwarded first. A failed clone is reported and
+        does not stop the others, progress is printed in the order of images.
+
+        Args:
+            images (list): Images whose repositories should be cloned
+            update (bool, optional): Update existing repositories,
+                defaults to the update_downstreams config value
+
+        Returns:
+            dict: Repo of every component that was cloned or reused
+        """
+        if update is None:
+            update = self.conf.update_downstreams
+        branches = {}
+        for image in images:
+            refs = branches.setdefault(image["component"], [])
+            for branch in (image["git_branch"], image.get("git_future")):
+                if branch and branch not in refs:
+                    refs.append(branch)
+        repos = {}
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.conf.clone_workers) as executor:
+            futures = {component: executor.submit(self._get_downstream, component, refs, update)
+                       for component, refs in branches.items()}
+            for i, (component, future) in enumerate(futures.items(), 1):
+                progress = f"[{i}/{len(futures)}] {component}"
+                try:
+                    repos[component], status = future.result()
+                except (RebuilderError, GitError) as e:
+                    failed.append(component)
+                    self.logger.error(f"{progress}: {e}")
+                    continue
+                self.logger.info(f"{progress}: {status}")
+        if failed:
+            self.logger.error("Failed cloning images:")
+            for component in failed:
+                self.logger.error(utility._2sp(component))
+        return repos
+
+    def _get_downstream(self, component, branches, update=False):
+        """Clones or reuses a downstream repo, returns it with a description of what was done"""
+        existing = os.path.isdir(component)
+        repo = self._clone_downstream(component, branches[0], verbose=False)
+        if not existing:
+            return repo, "cloned"
+        if not update:
+            return repo, "using existing repo"
+        return repo, self._update_downstream(repo, branches)
+
+    def _update_downstream(self, repo, branches):
+        """Fetches the branches of an existing downstream repo and fast-forwards them
+
+        Only the given branches are fetched. Local branches that are ahead
+        of or diverged from the remote ones are left untouched.
+
+        Returns:
+            str: Description of the update
+        """
+        component = os.path.basename(repo.working_dir)
+        repo.git.fetch("origin", *[f"+refs/heads/{b}:refs/remotes/origin/{b}" for b in branches])
+        local = {head.name: head for head in repo.heads}
+        updated = []
+        diverged = []
+        for branch in branches:
+            if branch not in local:
+                # Created from the remote branch when checked out
+                continue
+            head = local[branch].commit.hexsha
+            remote = repo.commit(f"origin/{branch}").hexsha
+            if head == remote or repo.is_ancestor(remote, head):
+                continue
+            if not repo.is_ancestor(head, remote):
+                diverged.append(branch)
+                self.logger.warning(f"{component}: branch {branch} diverged from origin, not updating it")
+                continue
+            try:
+                if not repo.head.is_detached and repo.active_branch.name == branch:
+                    repo.git.merge("--ff-only", f"origin/{branch}")
+                else:
+                    repo.git.branch("-f", branch, f"origin/{branch}")
+            except GitCommandError as e:
+                diverged.append(branch)
+                self.logger.warning(f"{component}: could not fast-forward branch {branch}: {e}")
+                continue
+            updated.append(branch)
+        status = []
+        if updated:
+            status.append("updated " + ", ".join(updated))
+        if diverged:
+            status.append("not updated " + ", ".join(diverged))
+        return "; ".join(status) or "up to date"
 
-    def _clone_downstream(self, component, branch):
+    def _clone_downstream(self, component, branch, verbose=True):
         """Clones downstream dist-git repo"""
+        log = self.logger.info if verbose else self.logger.debug
         # Do not set up downstream repo if it already exists
         if os.path.isdir(component):
-            self.logger.info("Using existing downstream repo: " + component)
+            log("Using existing downstream repo: " + component)
             repo = Repo(component)
         else:
             hostname_url = utility._get_hostname_url(self.conf)
@@ -135,7 +238,7 @@ class DistgitAPI(GitOperations):
                 cmd = packager
                 ccomponent = component_path
 
-            self.logger.info("Cloning into: " + ccomponent)
+            log("Cloning into: " + ccomponent)
             ret = subprocess.run([cmd, "clone", ccomponent],
                                  stdout=subprocess.DEVNULL,
                                  stderr=subprocess.DEVNULL)
@@ -184,12 +287,15 @@ class DistgitAPI(GitOperations):
         """Merges current branch with future branches"""
         # Check for kerberos ticket
         failed = []
+        repos = self.clone_downstreams(images)
         for image in images:
             component = image["component"]
             branch = image["git_branch"]
             # TODO: config only has one future branch
             fb_list = [image["git_future"]]
-            repo = self._clone_downstream(component, branch)
+            if component not in repos:
+                continue
+            repo = repos[component]
             for fb in fb_list:
                 try:
                     repo.git.checkout(fb)
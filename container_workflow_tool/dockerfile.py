@@ -22,6 +22,7 @@
 
 import os
 import re
+from typing import Dict, List
 
 from container_workflow_tool.utility import setup_logger, RebuilderError
 
@@ -52,6 +53,102 @@ class DockerfileHandler:
             return image_base.group(1)
         raise RebuilderError("FROM field is missing")
 
+    def get_froms(self, fdata: str) -> List[str]:
+        """Gets images of all FROM instructions in a Dockerfile
+
+        References to earlier build stages are left out.
+
+        Args:
+            fdata (str): String containing the Dockerfile
+
+        Returns:
+            list: Images used in FROM instructions
+        """
+        froms = []
+        stages = set()
+        for match in re.finditer(r"^[ \t]*FROM[ \t]+(?:--\S+[ \t]+)*(\S+)(?:[ \t]+AS[ \t]+(\S+))?",
+                                 fdata, re.MULTILINE | re.IGNORECASE):
+            image, stage = match.groups()
+            if image.lower() not in stages:
+                froms.append(image)
+            if stage:
+                stages.add(stage.lower())
+        return froms
+
+    def get_name(self, fdata: str) -> str:
+        """Gets the name label from a Dockerfile
+
+        Variables defined by ENV and ARG instructions are expanded.
+
+        Args:
+            fdata (str): String containing the Dockerfile
+
+        Returns:
+            str: Value of the name label, None if not set
+        """
+        variables = {}
+        name = None
+        for line in fdata.replace("\\\n", " ").splitlines():
+            instruction, _, args = line.strip().partition(" ")
+            instruction = instruction.upper()
+            pairs = re.findall(r'(\w+)=("[^"]*"|\S*)', args)
+            if instruction in ("ENV", "ARG"):
+                if not pairs and args.split():
+                    # Legacy "ENV key value" form
+                    key, _, value = args.strip().partition(" ")
+                    pairs = [(key, value.strip())]
+                for key, value in pairs:
+                    variables[key] = self._expand(value.strip('"'), variables)
+            elif instruction == "LABEL":
+                for key, value in pairs:
+                    if key == "name":
+                        name = self._expand(value.strip('"'), variables)
+        return name
+
+    @staticmethod
+    def _expand(value: str, variables: Dict[str, str]) -> str:
+        return re.sub(r"\$\{?(\w+)\}?", lambda m: variables.get(m.group(1), ""), value)
+
+    @staticmethod
+    def _image_key(image: str) -> str:
+        """Returns the image name without registry, namespace and tag"""
+        return image.split("@")[0].rsplit("/", 1)[-1].split(":")[0]
+
+    def get_build_graph(self, images: List, workdir: str, df_name: str = "Dockerfile") -> Dict[str, List[str]]:
+        """Creates the dependency graph of images from their downstream Dockerfiles
+
+        An image depends on another one if it is built FROM it. Images are matched
+        by the name label of their Dockerfile, their name or component.
+
+        Args:
+            images (list): Images to include in the graph
+            workdir (str): Directory containing the dist-git repositories
+            df_name (str, optional): Name of the Dockerfile in the repositories
+
+        Returns:
+            dict: Components mapped to the list of components they are built from
+        """
+        components = {}
+        froms = {}
+        for image in images:
+            component = image["component"]
+            path = os.path.join(workdir, component, df_name)
+            try:
+                with open(path) as f:
+                    fdata = f.read()
+            except OSError:
+                self.logger.debug(f"No Dockerfile found for {component}, leaving it out of the graph")
+                continue
+            froms[component] = self.get_froms(fdata)
+            for name in (component, image.get("name"), self.get_name(fdata)):
+                if name:
+                    components.setdefault(self._image_key(name), component)
+        graph = {}
+        for component, images_from in froms.items():
+            parents = {components.get(self._image_key(image)) for image in images_from}
+            graph[component] = sorted(p for p in parents if p and p != component)
+        return graph
+
     def set_from(self, fdata, from_tag):
         """
         Updates FROM field from a Dockerfile with value defined in configuration file
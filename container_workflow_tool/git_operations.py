@@ -24,11 +24,13 @@ import os
 import subprocess
 import shutil
 import re
+import fcntl
+import hashlib
 
 from git import Repo
 from git.exc import GitCommandError
 
-from container_workflow_tool.utility import RebuilderError, setup_logger
+from container_workflow_tool.utility import RebuilderError, setup_logger, _get_cache_dir
 from container_workflow_tool.sync import SyncHandler
 
 
@@ -45,6 +47,8 @@ class GitOperations(object):
         self.df_ext = self.conf.df_ext
         self.sync_handler = SyncHandler(logger=logger)
         self.commit_msg = None
+        # Upstream trees prepared by clone_upstream, shared by images using the same upstream
+        self._upstreams = {}
 
     def set_commit_msg(self, msg):
         """
@@ -68,7 +72,128 @@ class GitOperations(object):
                 repo.git.clean('-xfd', f)
                 self.logger.debug("Removing untracked ignored file: " + f)
 
-    def clone_upstream(self, url, ups_path, commands=None):
+    def _update_mirror(self, url):
+        """
+        Creates or updates the bare mirror of a repository kept in the user cache directory,
+        only objects that are not in the mirror yet are fetched
+        :param: url is URL of the repository
+        :return: path to the mirror
+        """
+        path = os.path.join(_get_cache_dir(), "mirrors", hashlib.sha1(url.encode()).hexdigest() + ".git")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".lock", "w") as lock:
+            # Other threads and cwt processes may use the same mirror
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.isdir(path):
+                self.logger.debug(f"Fetching {url} into mirror {path}")
+                Repo(path).git.fetch("--prune", "--tags", "origin")
+            else:
+                self.logger.debug(f"Creating mirror of {url} in {path}")
+                # An interrupted clone does not leave a broken mirror behind
+                tmp = path + ".tmp"
+                shutil.rmtree(tmp, ignore_errors=True)
+                repo = Repo.clone_from(url=url, to_path=tmp, bare=True)
+                repo.git.config("remote.origin.fetch", "+refs/heads/*:refs/heads/*")
+                os.rename(tmp, path)
+        return path
+
+    def _get_clone_options(self):
+        """Returns the options limiting what is downloaded by an upstream clone"""
+        options = {}
+        if self.conf.upstream_depth:
+            options["depth"] = self.conf.upstream_depth
+        if self.conf.upstream_filter:
+            options["filter"] = self.conf.upstream_filter
+        return options
+
+    def _get_symlink_dirs(self, path):
+        """
+        Returns the top level directories of a repository that symlinks
+        in its working tree point to but which are not checked out.
+        """
+        root = os.path.abspath(path)
+        dirs = set()
+        for dirpath, dirnames, filenames in os.walk(root):
+            if ".git" in dirnames:
+                dirnames.remove(".git")
+            for name in dirnames + filenames:
+                link = os.path.join(dirpath, name)
+                if not os.path.islink(link) or os.path.exists(link):
+                    continue
+                target = os.path.normpath(os.path.join(dirpath, os.readlink(link)))
+                rel = os.path.relpath(target, root)
+                # Links outside of the repository are left alone, the files
+                # in its root are always checked out so a missing target is a directory
+                if rel == os.curdir or rel.startswith(os.pardir):
+                    continue
+                dirs.add(rel.split(os.sep)[0])
+        return dirs
+
+    def _sparse_checkout(self, repo, paths, fresh=False):
+        """
+        Limits the working tree of an upstream repository to the given directories
+        and the directories the symlinks inside them need.
+
+        :param: repo is the repository, cloned with no checkout when fresh is set
+        :param: paths are the directories to check out
+        :return: set of the checked out directories
+        """
+        dirs = set(paths)
+        if fresh:
+            repo.git.sparse_checkout("set", "--cone", *sorted(dirs))
+            repo.git.checkout(repo.active_branch.name)
+        else:
+            repo.git.sparse_checkout("add", *sorted(dirs))
+        # The newly checked out directories can contain further symlinks
+        missing = self._get_symlink_dirs(repo.working_dir) - dirs
+        while missing:
+            self.logger.debug("Checking out symlink targets: " + ", ".join(sorted(missing)))
+            repo.git.sparse_checkout("add", *sorted(missing))
+            dirs |= missing
+            missing = self._get_symlink_dirs(repo.working_dir) - dirs
+        return dirs
+
+    def _update_submodules(self, repo, dirs=None):
+        """Initializes the submodules, only those inside dirs when given"""
+        for submodule in repo.submodules:
+            if dirs is not None and submodule.path.split("/")[0] not in dirs:
+                continue
+            submodule.update(init=True)
+
+    def _clone_upstream_repo(self, url, ups_path, paths=None):
+        """
+        Clones an upstream repository, or opens it if it exists already.
+
+        :param: paths are the directories of a sparse checkout, None checks out everything
+        :return: tuple of the repo object and the set of the checked out directories
+        """
+        prepared = set()
+        options = self._get_clone_options()
+        sparse = paths is not None
+        try:
+            if self.conf.mirror_upstreams and not options:
+                # Local clone of the mirror, objects are hardlinked instead of downloaded
+                repo = Repo.clone_from(url=self._update_mirror(url), to_path=ups_path,
+                                       no_checkout=sparse)
+                repo.remote().set_url(url)
+            else:
+                # Shallow and partial clones are fetched directly, the mirrors are complete
+                repo = Repo.clone_from(url=url, to_path=ups_path, no_checkout=sparse, **options)
+            if sparse:
+                prepared = self._sparse_checkout(repo, paths, fresh=True)
+            self.logger.info("Cloned into: " + url)
+            self._update_submodules(repo, prepared if sparse else None)
+
+        except GitCommandError:
+            # Generally the directory already exists, try to open as a repo instead
+            # Throws InvalidGitRepositoryError if it is not a git repo
+            repo = Repo(ups_path)
+            self.logger.info("Using existing repository.")
+            if sparse and repo.git.config("core.sparseCheckout", with_exceptions=False) == "true":
+                prepared = self._sparse_checkout(repo, paths)
+        return repo, prepared
+
+    def clone_upstream(self, url, ups_path, commands=None, paths=None):
         """
         :params: url is URL to repofile from upstream. https://github.com/sclorg
         :param: ups_path is path where URL is cloned locally
@@ -79,19 +204,26 @@ class GitOperations(object):
                user: "luhliari"
                commands:
                  1: "make generate-all"
+        :param: paths are the directories synced from the upstream, with upstream_sparse
+         set only these and the directories their symlinks point to are checked out
+        An upstream is cloned and its commands are run only once per run,
+        later calls with the same arguments return the prepared tree.
         :return: repo object
         """
-        try:
-            repo = Repo.clone_from(url=url, to_path=ups_path)
-            self.logger.info("Cloned into: " + url)
-            for submodule in repo.submodules:
-                submodule.update(init=True)
-
-        except GitCommandError:
-            # Generally the directory already exists, try to open as a repo instead
-            # Throws InvalidGitRepositoryError if it is not a git repo
-            repo = Repo(ups_path)
-            self.logger.info("Using existing repository.")
+        key = (url, os.path.abspath(ups_path), tuple(sorted((commands or {}).items())))
+        sparse = bool(self.conf.upstream_sparse and paths)
+        if key in self._upstreams:
+            repo, prepared = self._upstreams[key]
+            missing = set(paths or []) - prepared
+            if not sparse or not missing:
+                self.logger.info("Using upstream prepared for a previous image: " + url)
+                return repo
+            # The commands have to see the newly checked out directories, run them again
+            self.logger.info("Checking out more of the prepared upstream: " + url)
+            prepared |= self._sparse_checkout(repo, missing)
+            self._update_submodules(repo, prepared)
+        else:
+            repo, prepared = self._clone_upstream_repo(url, ups_path, paths if sparse else None)
 
         # Run the commands either way
         self.logger.debug("Running commands in upstream repo.")
@@ -111,8 +243,25 @@ class GitOperations(object):
                     self.logger.error(ret.stderr)
                     raise RebuilderError(msg)
         os.chdir(oldcwd)
+        self._upstreams[key] = (repo, prepared)
         return repo
 
+    @staticmethod
+    def get_upstream_paths(images):
+        """
+        Returns the directories synced from each upstream, keyed by the upstream name,
+        so that a sparse checkout covers all images using the upstream at once.
+        """
+        paths = {}
+        for image in images:
+            ups_name = image["name"].split('-')[0]
+            paths.setdefault(ups_name, set()).add(image["git_path"])
+        return {ups_name: sorted(dirs) for ups_name, dirs in paths.items()}
+
+    def forget_upstreams(self):
+        """Makes clone_upstream prepare the upstreams again, e.g. after they were removed"""
+        self._upstreams.clear()
+
     def are_unpushed_commits_available(self, repo, branch_name="") -> bool:
         """
         Get unpushed commits
@@ -1,22 +1,243 @@
+import re
+import json
+import hashlib
+import logging
+import functools
+import itertools
+import contextlib
+import tracemalloc
 import xmlrpc.client
+from urllib.parse import urlsplit
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
 
 import container_workflow_tool.utility as u
+from container_workflow_tool.cache import KojiCache
+from container_workflow_tool.transport import PooledTransport
+
+# Koji build state of successfully finished builds
+BUILD_COMPLETE = 1
+# Task states of koji
+TASK_FREE, TASK_OPEN, TASK_CLOSED, TASK_CANCELED, TASK_ASSIGNED, TASK_FAILED = range(6)
+# Hub calls whose responses do not change once the build is complete
+IMMUTABLE_CALLS = ("getBuild", "listArchives")
+# Hub calls answering which build is the latest one in a tag
+LATEST_CALLS = ("getLatestBuilds", "listTagged")
+# Build fields kept from tag histories when looking for the latest release
+BUILD_FIELDS = ("build_id", "nvr", "epoch", "version", "release")
+
+_SEGMENT = re.compile(r"~|\^|[0-9]+|[a-zA-Z]+")
+
+
+def _rpmvercmp(a, b):
+    """Compares two version or release strings the way rpm does
+
+    Returns:
+        int: 1 if a is newer, -1 if b is newer, 0 if they are equal
+    """
+    if a == b:
+        return 0
+    for x, y in itertools.zip_longest(_SEGMENT.findall(a), _SEGMENT.findall(b)):
+        # Tilde sorts before everything else, even the end of the string
+        if x == "~" or y == "~":
+            if x != "~":
+                return 1
+            if y != "~":
+                return -1
+        # Caret sorts after the end of the string but before anything else
+        elif x == "^" or y == "^":
+            if x is None:
+                return -1
+            if y is None:
+                return 1
+            if x != "^":
+                return 1
+            if y != "^":
+                return -1
+        elif x is None or y is None:
+            # Whichever string still has segments left wins
+            return 1 if y is None else -1
+        elif x.isdigit() != y.isdigit():
+            # Numeric segments are newer than alphabetic ones
+            return 1 if x.isdigit() else -1
+        elif x.isdigit():
+            if int(x) != int(y):
+                return 1 if int(x) > int(y) else -1
+        elif x != y:
+            return 1 if x > y else -1
+    return 0
+
+
+def _compare_builds(a, b):
+    """Compares the epoch, version and release of two koji builds"""
+    epoch_a = int(a.get("epoch") or 0)
+    epoch_b = int(b.get("epoch") or 0)
+    if epoch_a != epoch_b:
+        return 1 if epoch_a > epoch_b else -1
+    return _rpmvercmp(a["version"], b["version"]) or _rpmvercmp(a["release"], b["release"])
 
 
 class KojiAPI:
     """Class for working with Koji."""
 
-    def __init__(self, conf, logger, latest=False):
-        url = "https://koji.fedoraproject.org/kojihub"
-        self.brew = xmlrpc.client.ServerProxy(url, allow_none=True)
+    def __init__(self, conf, logger, latest=False, cache_path=None):
+        self._brew = None
+        self.transport = None
+        self._brew_url = None
         self.nvrs = []
         self.buildinfo = {}
+        self.latest = {}
         self.conf = conf
         self.logger = logger if logger else u.setup_logger("koji")
         self.latest_by_nvr = latest
+        self.cache = KojiCache(cache_path, logger=self.logger)
+        # Futures of the hub calls currently in flight
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+    @property
+    def brew(self):
+        # The hub is (re)connected whenever the configured url changes
+        url = self.conf.koji_url
+        if self._brew is None or self._brew_url != url:
+            self.transport = PooledTransport(urlsplit(url).scheme, timeout=self.conf.koji_timeout)
+            self._brew = xmlrpc.client.ServerProxy(url, transport=self.transport, allow_none=True)
+            self._brew_url = url
+        return self._brew
+
+    @brew.setter
+    def brew(self, proxy):
+        self._brew = proxy
+        self.transport = None
+        self._brew_url = self.conf.koji_url
+
+    @property
+    def cache(self):
+        # Responses of different hubs are kept apart, also before the hub is connected
+        self._cache.namespace = self.conf.koji_url
+        return self._cache
+
+    @cache.setter
+    def cache(self, cache):
+        self._cache = cache
 
     def clear_cache(self):
+        self.nvrs = []
         self.buildinfo = {}
+        self.latest = {}
+        self.cache.purge()
+
+    @staticmethod
+    def _cache_method(method, fields=None):
+        """Returns the name a response is cached under, projected responses are kept apart"""
+        if fields is None:
+            return method
+        return "{}[{}]".format(method, ",".join(fields))
+
+    def _store(self, method, params, result, fields=None):
+        """Stores a hub response in the persistent cache if it may be reused"""
+        if method in IMMUTABLE_CALLS:
+            # Builds that have not finished yet may still change
+            if method == "getBuild" and (not result or result.get("state") != BUILD_COMPLETE):
+                return
+            self.cache.set(self._cache_method(method, fields), params, result)
+        elif method in LATEST_CALLS:
+            self.cache.set(self._cache_method(method, fields), params, result, ttl=self.conf.koji_cache_ttl)
+
+    def _cached(self, method, params, fields=None):
+        """Returns a cached hub response or None"""
+        if method in IMMUTABLE_CALLS or method in LATEST_CALLS:
+            return self.cache.get(self._cache_method(method, fields), params)
+        return None
+
+    def _call(self, method, *params):
+        """Calls a hub method, answering from the persistent cache if possible"""
+        result = self._cached(method, params)
+        if result is None:
+            result = getattr(self.brew, method)(*params)
+            self._store(method, params, result)
+        return result
+
+    @staticmethod
+    def _kwargs(**kwargs):
+        """Encodes keyword arguments of a hub call the way koji does"""
+        kwargs["__starstar"] = True
+        return kwargs
+
+    def _multicall(self, calls, fresh=False, fields=None):
+        """Runs hub calls in chunked multicall batches
+
+        Calls answered by the persistent cache are not sent to the hub,
+        unless fresh is set. Identical calls are sent only once, even when
+        they are already in flight in another thread, and their result is
+        shared by all the callers.
+        A failing call does not affect the other calls in the batch,
+        its result is replaced by the xmlrpc.client.Fault it raised.
+
+        Args:
+            calls (list of (str, tuple)): Method names and their arguments
+            fresh (bool, optional): Do not use cached responses
+            fields (tuple, optional): Keep only these members of the returned structs
+
+        Returns:
+            list: Results in the same order as calls
+        """
+        results = [None if fresh else self._cached(method, params, fields) for method, params in calls]
+        pending = []
+        owned = {}
+        shared = []
+        with self._inflight_lock:
+            for i, res in enumerate(results):
+                if res is not None:
+                    continue
+                key = json.dumps([calls[i], fields], default=str)
+                if key in owned:
+                    shared.append((i, owned[key]))
+                elif key in self._inflight:
+                    shared.append((i, self._inflight[key]))
+                else:
+                    owned[key] = self._inflight[key] = Future()
+                    pending.append((i, owned[key]))
+        if shared:
+            msg = "Saved {} of {} hub calls by sharing identical calls"
+            self.logger.debug(msg.format(len(shared), len(calls)))
+
+        size = self.conf.koji_multicall_size
+        error = None
+        try:
+            with self._projection(fields):
+                for start in range(0, len(pending), size):
+                    chunk = pending[start:start + size]
+                    batch = [{"methodName": calls[i][0], "params": list(calls[i][1])}
+                             for i, _ in chunk]
+                    self.logger.debug("Sending multicall with {} calls".format(len(batch)))
+                    response = self.brew.multiCall(batch)
+                    if len(response) != len(batch):
+                        msg = "Multicall returned {} results for {} calls"
+                        raise xmlrpc.client.ResponseError(msg.format(len(response), len(batch)))
+                    for (i, future), res in zip(chunk, response):
+                        if isinstance(res, dict):
+                            # Faults are returned in place of the result
+                            results[i] = xmlrpc.client.Fault(res.get("faultCode"),
+                                                             res.get("faultString"))
+                        else:
+                            results[i] = res[0]
+                            self._store(*calls[i], res[0], fields=fields)
+                        future.set_result(results[i])
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            # Do not leave the callers sharing these calls waiting
+            for future in owned.values():
+                if not future.done():
+                    future.set_exception(error or xmlrpc.client.ResponseError("The hub call was not answered"))
+            with self._inflight_lock:
+                for key in owned:
+                    del self._inflight[key]
+        for i, future in shared:
+            results[i] = future.result()
+        return results
 
     def get_time_built(self, nvr):
         """Gets time built from brew"""
@@ -33,65 +254,352 @@ class KojiAPI:
         self.logger.debug("Getting taskinfo for task " + str(task_id))
         return self.brew.getTaskInfo(task_id)
 
+    def get_task_states(self, task_ids):
+        """Gets states of several tasks in multicall batches
+
+        Returns:
+            dict: State (or None if it could not be fetched) for every task id
+        """
+        self.logger.debug("Getting state of tasks " + ", ".join(map(str, task_ids)))
+        states = {}
+        for task_id, res in zip(task_ids, self._multicall([("getTaskInfo", (t,)) for t in task_ids])):
+            if isinstance(res, xmlrpc.client.Fault):
+                msg = "Failed to get taskinfo for task {}: {}"
+                self.logger.warning(msg.format(task_id, res.faultString))
+                res = None
+            states[task_id] = res["state"] if res else None
+        return states
+
     def get_listarchives(self, build_id):
         """Gets list archive for build_id"""
         self.logger.debug("Gettings list archives for build_id " + str(build_id))
-        return self.brew.listArchives(build_id)
+        return self._call("listArchives", build_id)
 
     def get_buildinfo(self, nvr):
         """Gets build info from brew"""
         if nvr not in self.buildinfo:
             self.logger.debug("Getting buildinfo for " + nvr)
-            self.buildinfo[nvr] = self.brew.getBuild(nvr)
+            self.buildinfo[nvr] = self._call("getBuild", nvr)
         else:
             self.logger.debug("Buildinfo for {} found in cache".format(nvr))
         return self.buildinfo[nvr]
 
+    def get_buildinfo_batch(self, nvrs):
+        """Gets build info for several nvrs from brew in multicall batches
+
+        Returns:
+            list of dict: Build info in the order of nvrs, None if it could not be fetched
+        """
+        missing = [nvr for nvr in dict.fromkeys(nvrs) if nvr not in self.buildinfo]
+        if missing:
+            self.logger.debug("Getting buildinfo for " + ", ".join(missing))
+            for nvr, res in zip(missing, self._multicall([("getBuild", (nvr,)) for nvr in missing])):
+                if isinstance(res, xmlrpc.client.Fault):
+                    msg = "Failed to get buildinfo for {}: {}"
+                    self.logger.warning(msg.format(nvr, res.faultString))
+                    continue
+                self.buildinfo[nvr] = res
+        return [self.buildinfo.get(nvr) for nvr in nvrs]
+
+    def get_listarchives_batch(self, build_ids):
+        """Gets list archives for several build ids in multicall batches
+
+        Returns:
+            list of list: Archives in the order of build_ids, None if they could not be fetched
+        """
+        self.logger.debug("Getting list archives for build_ids " + ", ".join(map(str, build_ids)))
+        archives = []
+        for build_id, res in zip(build_ids, self._multicall([("listArchives", (b,)) for b in build_ids])):
+            if isinstance(res, xmlrpc.client.Fault):
+                msg = "Failed to get list archives for build_id {}: {}"
+                self.logger.warning(msg.format(build_id, res.faultString))
+                res = None
+            archives.append(res)
+        return archives
+
+    def _get_builds_chunk(self, items):
+        buildinfos = self.get_buildinfo_batch([item[0] for item in items])
+        build_ids = [info["build_id"] for info in buildinfos if info]
+        archives = iter(self.get_listarchives_batch(build_ids))
+        return [(item, info, next(archives) if info else None)
+                for item, info in zip(items, buildinfos)]
+
+    def iter_builds(self, items, chunk_size=10):
+        """Yields build info and archives of the given builds
+
+        The items are split into chunks that are fetched concurrently, each
+        with one getBuild and one listArchives multicall. Results are yielded
+        in the original order as soon as their chunk is ready.
+
+        Args:
+            items (list of tuple): Items as returned by get_nvrs, nvr must be set
+            chunk_size (int, optional): Number of builds fetched together
+
+        Yields:
+            (tuple, dict, list): The item, its build info and its archives
+        """
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+        with ThreadPoolExecutor(max_workers=self.conf.koji_workers) as executor:
+            futures = [executor.submit(self._get_builds_chunk, chunk) for chunk in chunks]
+            for future in futures:
+                yield from future.result()
+
     def get_all_builds(self, component, tag):
-        return self.brew.listTagged(tag, None, None, None, None, component)
+        return self._call("listTagged", tag, None, None, None, None, component)
 
     def get_nvrs(self, images):
         """Gets nvrs from brew
 
+        The look-ups for all images are sent in multicall batches, images
+        sharing the same component and build tag are looked up only once.
+
         Returns:
             list of (str, str, str, obj): Brew nvrs.
                                           Format: (nvr, component, name, Bug)
         """
         if not self.nvrs:
             images_num = len(images)
-            nvr_list = []
             self.logger.info("Fetching info from Brew... (0/{})".format(images_num))
-            for i, image in enumerate(images, 1):
-                if i % 10 == 0:
-                    self.logger.info("Fetching info from Brew... ({}/{})".format(i, images_num))
-                name = image["name"]
-                component = image["component"]
-                tag = image["build_tag"]
-                nvr = self.get_nvr(tag, component)
-                list_item = (nvr, name, component)
+            queries = [(image["build_tag"], image["component"]) for image in images]
+            latest = self.get_latest_nvrs(queries)
+            nvr_list = []
+            for image, query in zip(images, queries):
+                list_item = (latest[query], image["name"], image["component"])
                 nvr_list.append(list_item)
             self.logger.info("Fetching info from Brew... ({n}/{n})".format(n=images_num))
             self.nvrs = nvr_list
 
         return self.nvrs
 
-    def get_nvr(self, tag, component):
-        msg = "Getting latest nvr for component {} with tag {}"
-        self.logger.debug(msg.format(component, tag))
+    def get_latest_nvrs(self, queries):
+        """Gets latest nvrs for (tag, component) queries
+
+        Answers are memoized, only queries not seen before are sent to the
+        hub, all of them in a single batch.
+
+        Returns:
+            dict: Latest nvr (or None) for every query
+        """
+        missing = [query for query in dict.fromkeys(queries) if query not in self.latest]
+        if len(queries) > len(missing):
+            msg = "Saved {} of {} latest build look-ups by reusing identical queries"
+            self.logger.debug(msg.format(len(queries) - len(missing), len(queries)))
+        if missing:
+            for (tag, component), builds in zip(missing, self._latest_builds(missing)):
+                if isinstance(builds, xmlrpc.client.Fault):
+                    msg = "Failed to get latest nvr for component {}: {}"
+                    self.logger.warning(msg.format(component, builds.faultString))
+                    builds = []
+                self.latest[(tag, component)] = self._select_nvr(builds, tag, component)
+        return {query: self.latest[query] for query in queries}
+
+    @staticmethod
+    def get_source_commit(buildinfo):
+        """Gets the dist-git commit a build was made from
+
+        Returns:
+            str: Commit hash, None if it is not known
+        """
+        source = (buildinfo or {}).get("source") or ""
+        return source.partition("#")[2] or None
+
+    def get_source_commits(self, images):
+        """Gets the dist-git commits the latest builds of images were made from
+
+        Latest nvrs and their build info are fetched in multicall batches.
+
+        Returns:
+            dict: Commit hash (or None) for every component
+        """
+        return {component: self.get_source_commit(buildinfo)
+                for component, buildinfo in self._get_latest_buildinfo(images).items()}
+
+    def get_build_durations(self, images):
+        """Gets how long the latest builds of images took
+
+        Returns:
+            dict: Seconds from start to completion for every component whose latest build is known
+        """
+        durations = {}
+        for component, buildinfo in self._get_latest_buildinfo(images).items():
+            if buildinfo and buildinfo.get("start_ts") and buildinfo.get("completion_ts"):
+                durations[component] = buildinfo["completion_ts"] - buildinfo["start_ts"]
+        return durations
+
+    def _get_latest_buildinfo(self, images):
+        """Gets build info of the latest builds of images in multicall batches
+
+        Returns:
+            dict: Build info (or None) for every component
+        """
+        queries = [(image["build_tag"], image["component"]) for image in images]
+        latest = self.get_latest_nvrs(queries)
+        nvrs = [latest[query] for query in queries if latest[query]]
+        buildinfo = dict(zip(nvrs, self.get_buildinfo_batch(nvrs)))
+        return {component: buildinfo.get(latest[(tag, component)]) for tag, component in queries}
+
+    @staticmethod
+    def get_parent_nvr(buildinfo):
+        """Gets the nvr of the image a build was built on
+
+        Returns:
+            str: Nvr of the parent image build, None if it is not known
+        """
+        image = (buildinfo.get("extra") or {}).get("image") or {}
+        # Parents that are not koji builds have no build information
+        parents = {pullspec: build for pullspec, build in (image.get("parent_image_builds") or {}).items()
+                   if isinstance(build, dict)}
+        for build in parents.values():
+            if build.get("id") == image.get("parent_build_id"):
+                return build["nvr"]
+        # The last parent image is the one used by the final stage
+        for pullspec in reversed(image.get("parent_images") or []):
+            if pullspec in parents:
+                return parents[pullspec]["nvr"]
+        return None
+
+    def _snapshot_name(self, queries):
+        data = json.dumps([self.latest_by_nvr, sorted(queries)])
+        return "nvrs-" + hashlib.sha1(data.encode()).hexdigest()
+
+    def _moved_since(self, queries, event):
+        """Returns the queries whose answer may have changed after the event
+
+        Looks at the tag history of the build tags and all the tags they inherit from.
+        """
+        tags = sorted({tag for tag, _ in queries})
+        inheritance = self._multicall([("getFullInheritance", (tag,)) for tag in tags])
+        chains = {}
+        for tag, parents in zip(tags, inheritance):
+            if isinstance(parents, xmlrpc.client.Fault):
+                parents = []
+            chains[tag] = [tag] + [parent["name"] for parent in parents]
+        all_tags = sorted({t for chain in chains.values() for t in chain})
+        opts = [self._kwargs(tables=["tag_listing", "tag_inheritance"], tag=t, afterEvent=event)
+                for t in all_tags]
+        history = dict(zip(all_tags, self._multicall([("queryHistory", (o,)) for o in opts])))
+
+        moved = []
+        for tag, component in queries:
+            for t in chains[tag]:
+                res = history[t]
+                # Re-resolve everything for a tag whose history is unknown or whose inheritance changed
+                if isinstance(res, xmlrpc.client.Fault) or res.get("tag_inheritance"):
+                    moved.append((tag, component))
+                    break
+                if component in {entry.get("name") for entry in res.get("tag_listing", [])}:
+                    moved.append((tag, component))
+                    break
+        return moved
+
+    def get_nvr_changes(self, images):
+        """Gets nvrs that changed since the last call for the same images
+
+        The result of every call is stored together with the hub event ID
+        it is valid for. The next call only re-resolves components that
+        were tagged or untagged in their build tags after that event.
+
+        Returns:
+            list of (str, str, str, str): Changed nvrs.
+                                          Format: (previous nvr, nvr, name, component)
+        """
+        queries = list(dict.fromkeys((image["build_tag"], image["component"]) for image in images))
+        name = self._snapshot_name(queries)
+        event = self.brew.getLastEvent()["id"]
+        snapshot = self.cache.get_snapshot(name)
+        if snapshot is None:
+            self.logger.info("No previous results found, resolving all images")
+            previous, moved = {}, queries
+        else:
+            since, previous = snapshot
+            moved = self._moved_since(queries, since)
+            msg = "{} of {} components changed since event {}"
+            self.logger.debug(msg.format(len(moved), len(queries), since))
+
+        current = dict(previous)
+        results = self._latest_builds(moved, fresh=True)
+        for (tag, component), builds in zip(moved, results):
+            if isinstance(builds, xmlrpc.client.Fault):
+                msg = "Failed to get latest nvr for component {}: {}"
+                self.logger.warning(msg.format(component, builds.faultString))
+                continue
+            current[tag + "/" + component] = self._select_nvr(builds, tag, component)
+        self.cache.set_snapshot(name, event, current)
+
+        changes = []
+        for image in images:
+            key = image["build_tag"] + "/" + image["component"]
+            if previous.get(key) != current.get(key):
+                changes.append((previous.get(key), current.get(key), image["name"], image["component"]))
+        return changes
+
+    def _projection(self, fields):
+        if fields is None or self.transport is None:
+            return contextlib.nullcontext()
+        return self.transport.projection(fields)
+
+    def _latest_builds(self, queries, fresh=False):
+        """Runs the latest build look-ups for (tag, component) queries
+
+        Returns:
+            list: Builds found for every query or the Fault it raised
+        """
+        calls = [self._nvr_call(tag, component) for tag, component in queries]
+        if not self.latest_by_nvr:
+            return self._multicall(calls, fresh=fresh)
+
+        # Whole tag histories are transferred, so only the fields needed
+        # for comparing the builds are kept while parsing the responses.
+        # Connect first, the transport is created together with the hub proxy.
+        self.brew
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        tracing = debug and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        received = self.transport.thread_bytes_received() if self.transport else 0
+        results = self._multicall(calls, fresh=fresh, fields=BUILD_FIELDS)
+        if debug:
+            if self.transport:
+                received = self.transport.thread_bytes_received() - received
+                msg = "Received {} bytes of tag history for {} components ({} bytes per component)"
+                self.logger.debug(msg.format(received, len(queries), received // max(len(queries), 1)))
+            if tracing:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                msg = "Peak memory while resolving {} components: {} bytes ({} bytes per component)"
+                self.logger.debug(msg.format(len(queries), peak, peak // max(len(queries), 1)))
+            for (tag, component), builds in zip(queries, results):
+                if not isinstance(builds, xmlrpc.client.Fault):
+                    msg = "{} builds of {} found in {}"
+                    self.logger.debug(msg.format(len(builds), component, tag))
+        return results
+
+    def _nvr_call(self, tag, component):
+        """Returns the hub call used to look up the latest nvr"""
         if self.latest_by_nvr:
             # Lets get all the builds and use the latest (release-wise)
-            b = self.get_all_builds(component, tag)
-            builds = sorted(b, key=lambda x: float(x['release']), reverse=True)
-        else:
-            # Get latest by time built
-            builds = self.brew.getLatestBuilds(tag, None, component)
+            return "listTagged", (tag, None, None, None, None, component)
+        # Get latest by time built
+        return "getLatestBuilds", (tag, None, component)
 
+    def _select_nvr(self, builds, tag, component):
+        """Picks the latest nvr from the result of the _nvr_call look-up"""
+        if self.latest_by_nvr and builds:
+            builds = [max(builds, key=functools.cmp_to_key(_compare_builds))]
         nvr = builds[0]['nvr'] if builds else None
         if nvr is None:
             self.logger.warn("No build found for " + component + " using tag "
                              + tag)
         return nvr
 
+    def get_nvr(self, tag, component):
+        msg = "Getting latest nvr for component {} with tag {}"
+        self.logger.debug(msg.format(component, tag))
+        builds = self._latest_builds([(tag, component)])[0]
+        if isinstance(builds, xmlrpc.client.Fault):
+            raise builds
+        return self._select_nvr(builds, tag, component)
+
     def get_build_hashid(self, build_id, arch="x86_64"):
         """ Get hash id of an image for a specific architecture from brew """
         msg = "Getting hash id for build {} on {} architecture"
@@ -107,10 +615,21 @@ class KojiAPI:
 
     def get_build_hashids(self, build_id):
         """ Get hash ids of an image for all its architectures from brew """
-        hashids = []
         self.logger.debug("Getting hash ids for build " + str(build_id))
-        for archive in self.brew.listArchives(build_id):
+        return [(hashid, arch) for hashid, arch, _ in self.archive_hashids(self.get_listarchives(build_id))]
+
+    @staticmethod
+    def archive_hashids(archives):
+        """Extracts hash ids from the list archives of an image build
+
+        Returns:
+            list of (str, str, str): (hash id, arch, manifest digest) for every architecture,
+                                     the digest is None if it is not known
+        """
+        hashids = []
+        for archive in archives:
             hashid = archive['extra']['docker']['id']
             arch = archive['extra']['image']['arch']
-            hashids.append((hashid, arch))
+            digests = [r.split('@')[1] for r in archive['extra']['docker'].get('repositories', []) if '@' in r]
+            hashids.append((hashid, arch, digests[0] if digests else None))
         return hashids
@@ -5,20 +5,27 @@
 
 import subprocess
 import os
+import sys
 import shutil
 import re
 import tempfile
 import pprint
 import logging
+import json
+import csv
+import io
+import xmlrpc.client
 
 from git import Repo, GitError
-from typing import List, Any
+from typing import List, Any, Iterator, Dict
 from pathlib import Path
 
 import container_workflow_tool.utility as u
 from container_workflow_tool.koji import KojiAPI
+from container_workflow_tool.cache import BuildHistory
 from container_workflow_tool.distgit import DistgitAPI
 from container_workflow_tool.git_operations import GitOperations
+from container_workflow_tool.scheduler import BuildScheduler, BuildJournal, RetryPolicy, longest_chain
 from container_workflow_tool.utility import RebuilderError
 from container_workflow_tool.config import Config
 
@@ -60,7 +67,14 @@ class ImageRebuilder:
         self.image_set = None
         self.disable_klist = None
         self.output_file = None
+        self._file_handler = None
         self.latest_release = None
+        self.since_last = None
+        self.output_format = "json"
+        self.max_parallel_builds = None
+        self.skip_unchanged = None
+        self.resume = None
+        self.nowait = None
 
         self.logger = self._setup_logger()
         self.set_config(self.conf_name, release=release)
@@ -77,19 +91,45 @@ class ImageRebuilder:
         rebuilder.setup_log_to_file()
         return rebuilder
 
+    def _get_output_path(self) -> Path:
+        out_file = Path(self.output_file)
+        # If file is not absolute lets create out_file from current directory
+        if not out_file.is_absolute():
+            out_file = Path.cwd() / self.output_file
+        return out_file
+
     def setup_log_to_file(self):
         # File handler
         if self.output_file:
-            out_file = Path(self.output_file)
-            # If file is not absolute lets create out_file from current directory
-            if not out_file.is_absolute():
-                out_file = Path.cwd() / self.output_file
+            out_file = self._get_output_path()
             file_handler = logging.FileHandler(out_file)
             file_handler.setLevel(logging.INFO)
             file_format_str = "%(message)s"
             file_formatter = logging.Formatter(file_format_str)
             file_handler.setFormatter(file_formatter)
             self.logger.addHandler(file_handler)
+            self._file_handler = file_handler
+
+    def _log_to_stderr(self):
+        """Moves log messages printed to stdout to stderr, stdout is kept for machine readable output"""
+        for handler in self.logger.handlers:
+            if isinstance(handler, logging.StreamHandler) and handler.stream is sys.stdout:
+                handler.setStream(sys.stderr)
+
+    def _write_output(self, document: str):
+        """Writes a machine readable document to the output file if it is set, to stdout otherwise
+
+        The output file then contains only the document, without the log messages.
+        """
+        if not self.output_file:
+            sys.stdout.write(document + "\n")
+            return
+        if self._file_handler:
+            self.logger.removeHandler(self._file_handler)
+            self._file_handler.close()
+            self._file_handler = None
+        with open(self._get_output_path(), "w") as f:
+            f.write(document + "\n")
 
     def _setup_args(self, args):
         self.args = args
@@ -119,14 +159,34 @@ class ImageRebuilder:
             self.rebuild_reason = args.rebuild_reason
         if getattr(args, 'check_script', None) is not None and args.check_script:
             self.check_script = args.check_script
+        if getattr(args, 'update_downstreams', None) is not None:
+            self.conf.update_downstreams = args.update_downstreams
+        if getattr(args, 'upstream_depth', None) is not None:
+            self.conf.upstream_depth = args.upstream_depth
+        if getattr(args, 'upstream_filter', None) is not None:
+            self.conf.upstream_filter = args.upstream_filter
+        if getattr(args, 'upstream_sparse', None) is not None:
+            self.conf.upstream_sparse = args.upstream_sparse
         self.disable_klist = args.disable_klist
         self.latest_release = args.latest_release
+        if getattr(args, 'since_last', None) is not None:
+            self.since_last = args.since_last
+        if getattr(args, 'output_format', None) is not None and args.output_format:
+            self.output_format = args.output_format
         if getattr(args, 'output_file', None) is not None and args.output_file:
             self.output_file = args.output_file
 
         # Image set to build
         if getattr(args, 'image_set', None) is not None and args.image_set:
             self.image_set = args.image_set
+        if getattr(args, 'max_parallel_builds', None) is not None:
+            self.max_parallel_builds = args.max_parallel_builds
+        if getattr(args, 'skip_unchanged', None) is not None:
+            self.skip_unchanged = args.skip_unchanged
+        if getattr(args, 'resume', None) is not None:
+            self.resume = args.resume
+        if getattr(args, 'nowait', None) is not None:
+            self.nowait = args.nowait
 
     def _get_set_from_config(self, layer: str) -> str:
         i = getattr(self.conf, layer, [])
@@ -245,7 +305,7 @@ class ImageRebuilder:
             try:
                 repo = Repo(cwd)
             except GitError as e:
-                self.logger.error("Failed to open repository for {}", component)
+                self.logger.error(f"Failed to open repository for {component}")
                 raise e
             # This checks if any of the releases can be found in the name of the checked-out branch
             if releases and not [i for i in releases if i in str(repo.active_branch)]:
@@ -259,75 +319,93 @@ class ImageRebuilder:
             return
         if not branches:
             # Fill defaults from config if not provided
-            for release in self.conf.releases:
-                branches += [self.conf.releases[release]["current"]]
+            branches = [self.conf.releases[release]["current"] for release in self.conf.releases]
         self._prebuild_check(image_set, branches)
 
-        procs = []
-        triggers = []
         tmp = self._get_tmp_workdir(setup_dir=False)
+        max_parallel = self.max_parallel_builds
+        if max_parallel is None:
+            max_parallel = self.conf.max_parallel_builds
+        journal = BuildJournal(os.path.join(tmp, "build-journal.jsonl"), resume=self.resume)
+        history = BuildHistory()
+        scheduler = BuildScheduler(u._get_packager(self.conf), tmp,
+                                   max_parallel=max_parallel,
+                                   custom_args=custom_args,
+                                   logger=self.logger.getChild("build"),
+                                   journal=journal, koji=self.brewapi,
+                                   nowait=self.nowait,
+                                   retry=RetryPolicy(self.conf.build_max_attempts,
+                                                     self.conf.build_retry_delay,
+                                                     self.conf.build_retry_patterns),
+                                   durations=self._get_expected_durations(history),
+                                   history=history)
+        builds = scheduler.run(image_set, triggered=self._get_triggered_images,
+                               graph=self._get_build_graph(),
+                               unchanged=self._get_unchanged if self.skip_unchanged else None)
+        scheduler.report(builds)
+
+    def _get_unchanged(self, image_set: List) -> List:
+        """Returns components whose dist-git HEAD is the source of their latest koji build"""
+        tmp = self._get_tmp_workdir(setup_dir=False)
+        try:
+            built = self.brewapi.get_source_commits(image_set)
+        except (OSError, xmlrpc.client.Error) as e:
+            self.logger.warning(f"Could not get the sources of the latest builds, building all images: {e}")
+            return []
+        unchanged = []
         for image in image_set:
             component = image["component"]
-            cwd = os.path.join(tmp, component)
-            self.logger.info(f"Building image {component} ...")
-            args = [u._get_packager(self.conf), "container-build"]
-            if custom_args:
-                args.extend(custom_args)
-            proc = subprocess.Popen(args, cwd=cwd, stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE,
-                                    universal_newlines=True)
-            # Append the process and component information for later use
-            procs.append((proc, image))
-
-        self.logger.info("Fetching tasks...")
-        for proc, image in procs:
-            component = image["component"]
-            self.logger.debug(f"Query component: {component}")
-            # Iterate until a taskID is found
-            for stdout in iter(proc.stdout.readline, ""):
-                if "taskID" in stdout:
-                    self.logger.info(f"{component} - {stdout.strip()}")
-                    break
-            else:
-                # If we get here the command must have failed
-                # The error will get printed out later when getting all builds
-                self.logger.warning(f"Could not find task for {component}!")
-
-        self.logger.info("Waiting for builds...")
-        timeout = 30
-        while procs:
-            self.logger.debug("Looping over all running builds")
-            for proc, image in procs:
-                out = err = None
-                component = image["component"]
-                try:
-                    self.logger.debug(f"Waiting {timeout} seconds for {component}")
-                    out, err = proc.communicate(timeout=timeout)
-                except subprocess.TimeoutExpired:
-                    msg = "{} not yet finished, checking next build"
-                    self.logger.debug(msg.format(component))
-                    self.logger.debug(f"{component} not yet finished, checking next build")
-                    continue
-                if proc.returncode != 0:
-                    self.logger.error(f"{component} build has failed")
-                else:
-                    self.logger.info(f"{component} build has finished")
-                    # If this image triggers a new layer, build it
-                    if "trigger" in image:
-                        triggers.append((component, image["trigger"]))
-
-                self.logger.info(f"{component} build has finished")
-                if err:
-                    # Write out stderr if we encounter an error
-                    err = u._4sp(err)
-                    self.logger.error(err)
-
-                procs.remove((proc, image))
-
-        for component, trigger in triggers:
-            msg = "Triggering layered builds on image %s..."
-            self.logger.info(msg, component)
-            self.build_images(trigger)
+            head = Repo(os.path.join(tmp, component)).head.commit.hexsha
+            if built[component] == head:
+                self.logger.debug(f"Commit {head} of {component} is already built")
+                unchanged.append(component)
+        return unchanged
+
+    def _get_triggered_images(self, build) -> List:
+        """Returns images of the set triggered by a successful build"""
+        if "trigger" not in build.image:
+            return []
+        trigger = build.image["trigger"]
+        # If this image triggers a new layer, build it
+        self.logger.info("Triggering layered builds on image %s...", build.component)
+        try:
+            images = self._filter_images(self._get_set_from_config(trigger))
+            branches = [self.conf.releases[release]["current"] for release in self.conf.releases]
+            self._prebuild_check(images, branches)
+        except (RebuilderError, GitError) as e:
+            # Builds of other images keep running
+            self.logger.error(f"Cannot build images triggered by {build.component}: {e}")
+            return []
+        return images
+
+    def _get_all_images(self) -> List:
+        """Returns images of all configured image sets"""
+        images = []
+        for image_set in self.conf.image_sets:
+            images += self._get_set_from_config(image_set)
+        return images
+
+    def _get_build_graph(self) -> Dict[str, List[str]]:
+        """Returns the dependency graph of all configured images, read from their Dockerfiles"""
+        tmp = self._get_tmp_workdir(setup_dir=False)
+        return self.distgit.df_handler.get_build_graph(self._get_all_images(), tmp)
+
+    def _get_expected_durations(self, history: BuildHistory) -> Dict[str, float]:
+        """Returns expected build durations of all configured images
+
+        Durations recorded by previous runs are preferred, the duration
+        of the latest koji build is used for the other images.
+        """
+        images = self._get_all_images()
+        durations = history.get_durations([image["component"] for image in images])
+        missing = [image for image in images if image["component"] not in durations]
+        if missing:
+            try:
+                durations = {**self.brewapi.get_build_durations(missing), **durations}
+            except (OSError, xmlrpc.client.Error) as e:
+                # Builds are only ordered differently without the durations
+                self.logger.warning(f"Could not get build durations from koji: {e}")
+        return durations
 
     def _get_config_path(self, config: str) -> str:
         if not os.path.isabs(config):
@@ -341,41 +419,129 @@ class ImageRebuilder:
     def _not_yet_implemented(self):
         print("Method not yet implemented.")
 
-    def get_brew_builds(self, print_time: bool = True) -> List[str]:
-        """Returns information about builds in brew
+    def get_brew_builds(self, print_time: bool = True) -> Iterator[str]:
+        """Yields information about builds in brew
+
+        Build info and archives are fetched concurrently and the lines are
+        yielded in config order as soon as they are ready.
 
         Args:
             print_time (bool, optional): Print time finished for a build.
 
-        Returns:
-            str: Resulting brew build text
+        Yields:
+            str: Header followed by a line for every build found in brew
         """
-        output = []
         header = "||Component||Build||Image_name||"
         if print_time:
             header += "Build finished||"
         header += "Archives||"
-        output.append(header)
-        nvrs = (self.brewapi.get_nvrs(self._get_images()))
-        for item in nvrs:
+        yield header
+        nvrs = self.brewapi.get_nvrs(self._get_images())
+        # No nvr found for the image, might not have been built
+        nvrs = [item for item in nvrs if item[0] is not None]
+        for item, buildinfo, archives in self.brewapi.iter_builds(nvrs):
             nvr, name, component, *rest = item
-            # No nvr found for the image, might not have been built
-            if nvr is None:
+            if not buildinfo or not archives:
+                self.logger.warning(f"No build information found for {nvr}")
                 continue
-            else:
-                template = "|{0}|{1}|{2}|"
+            template = "|{0}|{1}|{2}|"
             vr = re.search(".*-([^-]*-[^-]*)$", nvr).group(1)
-            build_id = self.brewapi.get_buildinfo(nvr)["build_id"]
-            archives = self.brewapi.get_listarchives(build_id)
             archive = archives[0]["extra"]
             name = archive["docker"]["config"]["config"]["Labels"]["name"]
             image_name = f"{name}:{vr}"
             result = template.format(component, nvr, image_name)
             if print_time:
-                result += self.brewapi.get_time_built(nvr) + '|'
+                result += buildinfo['completion_time'] + '|'
             result += str(len(archives))
-            output.append(result)
-        return output
+            yield result
+
+    def get_latest_base(self) -> Iterator[str]:
+        """Yields the base image of every latest build and whether it is the latest one
+
+        The latest builds of the parents are looked up once for every
+        distinct parent and build tag.
+
+        Yields:
+            str: Header followed by a line for every build, then a summary
+        """
+        yield "||Component||Build||Base image||Latest base image||Status||"
+        tags = {image["component"]: image["build_tag"] for image in self._get_images()}
+        nvrs = [item for item in self.brewapi.get_nvrs(self._get_images()) if item[0] is not None]
+        parents = []
+        for item, buildinfo, archives in self.brewapi.iter_builds(nvrs):
+            component = item[2]
+            parent = self.brewapi.get_parent_nvr(buildinfo) if buildinfo else None
+            query = (tags[component], parent.rsplit("-", 2)[0]) if parent else None
+            parents.append((item, parent, query))
+        queries = [query for _, _, query in parents if query]
+        latest = self.brewapi.get_latest_nvrs(queries)
+        self.logger.debug(f"Resolved {len(set(queries))} distinct base images for {len(parents)} builds")
+        outdated = 0
+        for (nvr, name, component, *rest), parent, query in parents:
+            latest_nvr = latest.get(query)
+            if parent is None or latest_nvr is None:
+                status = "unknown"
+            elif parent == latest_nvr:
+                status = "latest"
+            else:
+                status = "outdated"
+                outdated += 1
+            yield f"|{component}|{nvr}|{parent}|{latest_nvr}|{status}|"
+        if outdated:
+            yield f"{outdated} builds are not built on the latest base image."
+        else:
+            yield "All builds with a known base image are built on the latest one."
+
+    def print_latest_base(self):
+        """Prints the base image of every latest build and whether it is the latest one"""
+        for line in self.get_latest_base():
+            self.logger.info(line)
+        self.brewapi.cache.report()
+
+    def get_hash_ids(self) -> List[dict]:
+        """Returns hash ids of the latest builds for all their architectures
+
+        Build info and archives of all builds are fetched in multicall batches.
+
+        Returns:
+            list of dict: One entry for every image and architecture
+        """
+        nvrs = [item for item in self.brewapi.get_nvrs(self._get_images()) if item[0] is not None]
+        result = []
+        for item, buildinfo, archives in self.brewapi.iter_builds(nvrs):
+            nvr, name, component, *rest = item
+            if not buildinfo or archives is None:
+                self.logger.warning(f"No build information found for {nvr}")
+                continue
+            for hashid, arch, digest in self.brewapi.archive_hashids(archives):
+                result.append({"component": component, "nvr": nvr, "arch": arch,
+                               "hash_id": hashid, "digest": digest})
+        return result
+
+    def print_hash_ids(self):
+        """Prints hash ids of the latest builds in JSON or CSV format"""
+        self._log_to_stderr()
+        hashids = self.get_hash_ids()
+        if self.output_format == "csv":
+            out = io.StringIO()
+            writer = csv.DictWriter(out, fieldnames=["component", "nvr", "arch", "hash_id", "digest"],
+                                    lineterminator="\n")
+            writer.writeheader()
+            writer.writerows(hashids)
+            self._write_output(out.getvalue().rstrip("\n"))
+        else:
+            self._write_output(json.dumps(hashids, indent=2))
+        self.brewapi.cache.report()
+
+    def get_brew_changes(self) -> Iterator[str]:
+        """Yields builds that changed in brew since the last call
+
+        Yields:
+            str: Header followed by a line for every changed build
+        """
+        yield "||Component||Previous build||Build||"
+        for old_nvr, nvr, name, component in self.brewapi.get_nvr_changes(self._get_images()):
+            yield f"|{component}|{old_nvr}|{nvr}|"
 
     def set_config(self, conf_name: str, release: str = "current"):
         """
@@ -460,6 +626,22 @@ class ImageRebuilder:
                   f"{image.get('git_url')} {image.get('git_path')} {image.get('git_branch')}"
             self.logger.info(msg)
 
+    def print_build_graph(self):
+        """Prints the images each image is built from and the longest chain of dependent builds"""
+        if not self._get_tmp_workdir(setup_dir=False):
+            msg = "Temporary directory structure does not exist. Clone downstream first."
+            raise RebuilderError(msg)
+        graph = self._get_build_graph()
+        components = [image["component"] for image in self._get_images()]
+        for component in components:
+            if component not in graph:
+                self.logger.info(f"{component}: Dockerfile not found")
+                continue
+            parents = graph[component]
+            self.logger.info(f"{component} <- {', '.join(parents) if parents else 'base image'}")
+        selected = {c: [p for p in graph[c] if p in components] for c in components if c in graph}
+        self.logger.info("Critical path: " + " -> ".join(longest_chain(selected)))
+
     def show_config_contents(self):
         """Prints the symbols and values of configuration used"""
         for key in self.conf:
@@ -485,14 +667,21 @@ class ImageRebuilder:
     def print_brew_builds(self, print_time: bool = True):
         """Prints information about builds in brew
 
+        Only builds changed since the last run are printed if since_last is set.
+
         Args:
             print_time (bool, optional): Print time finished for a build.
 
         Returns:
             str: Resulting brew build text
         """
-        for builds in self.get_brew_builds(print_time=print_time):
+        if self.since_last:
+            lines = self.get_brew_changes()
+        else:
+            lines = self.get_brew_builds(print_time=print_time)
+        for builds in lines:
             self.logger.info(builds)
+        self.brewapi.cache.report()
 
     def pull_downstream(self):
         """
@@ -502,11 +691,12 @@ class ImageRebuilder:
         checking its exit value.
         """
         tmp, images = self.preparation(setup_dir=True)
-        for image in images:
-            self.distgit._clone_downstream(image["component"], image["git_branch"])
+        repos = self.distgit.clone_downstreams(images)
         # If check script is set, run the script provided for each config entry
         if self.check_script:
             for image in images:
+                if image["component"] not in repos:
+                    continue
                 self.distgit.check_script(image["component"], self.check_script,
                                           image["git_branch"])
 
@@ -518,10 +708,12 @@ class ImageRebuilder:
         checking its exit value.
         """
         tmp, images = self.preparation(setup_dir=True)
+        ups_paths = self.git_ops.get_upstream_paths(images)
         for image in images:
             # Use unversioned name as a path for the repository
             ups_name = image["name"].split('-')[0]
-            self.git_ops.clone_upstream(image["git_url"], ups_name, commands=image["commands"])
+            self.git_ops.clone_upstream(image["git_url"], ups_name, commands=image["commands"],
+                                        paths=ups_paths[ups_name])
         # If check script is set, run the script provided for each config entry
         if self.check_script:
             for image in images:
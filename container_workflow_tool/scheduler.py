@@ -0,0 +1,635 @@
+# MIT License
+#
+# Copyright (c) 2023 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import re
+import json
+import time
+import heapq
+import selectors
+import subprocess
+import http.client
+import xmlrpc.client
+from collections import deque
+from typing import Dict, List
+
+from container_workflow_tool.koji import TASK_CLOSED, TASK_CANCELED, TASK_FAILED
+from container_workflow_tool.utility import setup_logger, _4sp
+
+QUEUED = "queued"
+SUBMITTED = "submitted"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+def longest_chain(graph: Dict[str, List[str]]) -> List[str]:
+    """Finds the longest chain of dependent images in a build graph
+
+    Args:
+        graph (dict): Components mapped to the components they are built from
+
+    Returns:
+        list: Components of the chain, starting with the first layer
+    """
+    chains: Dict[str, List[str]] = {}
+
+    def chain(component, visiting):
+        if component not in chains:
+            parents = [p for p in graph.get(component, []) if p not in visiting]
+            longest = max((chain(p, visiting | {component}) for p in parents), key=len, default=[])
+            chains[component] = longest + [component]
+        return chains[component]
+
+    return max((chain(c, frozenset()) for c in graph), key=len, default=[])
+
+
+class RetryPolicy:
+    """Decides which failed builds are attempted again and when"""
+
+    def __init__(self, max_attempts=1, delay=60, patterns=None):
+        """
+        Args:
+            max_attempts (int, optional): Maximum number of attempts of a build
+            delay (int, optional): Seconds before the first retry, doubled with every further one
+            patterns (list, optional): Regular expressions matching stderr of transient failures
+        """
+        self.max_attempts = max_attempts
+        self.delay = delay
+        self.patterns = [re.compile(pattern) for pattern in patterns or []]
+
+    def is_transient(self, stderr: str) -> bool:
+        return any(pattern.search(stderr) for pattern in self.patterns)
+
+    def get_delay(self, attempt: int) -> float:
+        """Returns seconds to wait before the attempt following the given one"""
+        return self.delay * 2 ** (attempt - 1)
+
+
+class BuildJournal:
+    """Records the state of every build of a run, so the run can be resumed
+
+    Each change of state is appended to the journal file as a JSON line,
+    the last line of a component wins when the journal is read.
+    """
+
+    def __init__(self, path, resume=False):
+        """
+        Args:
+            path (str): Path to the journal file
+            resume (bool, optional): Keep the states of the previous run instead of starting anew
+        """
+        self.path = path
+        self.states = {}
+        # States recorded by the previous run
+        self.previous = {}
+        if resume and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Last line of an interrupted run
+                        continue
+                    self.states[entry["component"]] = entry
+        self.previous = dict(self.states)
+        with open(path, "w") as f:
+            for entry in self.states.values():
+                f.write(json.dumps(entry) + "\n")
+
+    def get(self, component):
+        """Returns the entry of a component recorded by the previous run, None if there is none"""
+        return self.previous.get(component)
+
+    def record(self, build, state):
+        entry = {"component": build.component, "state": state, "task_id": build.task_id}
+        self.states[build.component] = entry
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+
+class Build:
+    """State of a single image build."""
+
+    def __init__(self, image, parent=None):
+        self.image = image
+        self.component = image["component"]
+        # Build whose success triggered this one
+        self.parent = parent
+        self.skipped = False
+        # Taken over from a previous run
+        self.resumed = False
+        self.attempt = 1
+        # Time before which a retried build is not started
+        self.not_before = 0
+        self.proc = None
+        self.streams = []
+        self.log = None
+        self.log_path = None
+        # Incomplete stdout line kept while looking for the task ID
+        self.stdout_line = b""
+        # Last part of stderr, reported when the build ends
+        self.stderr = b""
+        self.task_id = None
+        self.returncode = None
+        self.queued = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def done(self):
+        """True once the build ended and all of its output was read"""
+        if self.proc is None:
+            # Builds watched through koji end once their task does
+            return self.returncode is not None
+        return not self.streams
+
+    @property
+    def succeeded(self):
+        return self.returncode == 0
+
+    @property
+    def queue_wait(self):
+        return self.started - self.queued
+
+    @property
+    def duration(self):
+        return self.finished - self.started
+
+    @property
+    def chain(self):
+        """Builds leading to this one, starting with the first layer"""
+        chain = [self]
+        while chain[0].parent:
+            chain.insert(0, chain[0].parent)
+        return chain
+
+
+class BuildScheduler:
+    """Runs container builds with a bounded number of parallel builds.
+
+    Images wait in a queue and the next one is started as soon as
+    a running build finishes. Output of all running builds is read
+    through a selector, so the end of a build is noticed the moment
+    its pipes are closed. The output is written to a log file of each
+    component in <workdir>/logs, only the end of stderr is kept in memory.
+    """
+
+    # Seconds to wait for output before checking builds that closed
+    # their pipes early, e.g. because a child process kept them open
+    poll_interval = 30
+    read_size = 65536
+    # Bytes of stderr kept for the error report
+    tail_size = 8192
+    # Seconds between checks of koji tasks that are not watched by a packager process,
+    # the delay doubles from the minimum up to the maximum while no task ends
+    task_poll_min = 5
+    task_poll_interval = 60
+
+    def __init__(self, packager, workdir, max_parallel=0, custom_args=None, logger=None,
+                 journal=None, koji=None, nowait=False, retry=None, durations=None, history=None):
+        """
+        Args:
+            packager (str): Packager utility used to run the builds
+            workdir (str): Directory containing the dist-git repositories
+            max_parallel (int, optional): Maximum number of parallel builds, unlimited if 0
+            custom_args (list, optional): Additional arguments of container-build
+            logger (Logger, optional): Logger to be used
+            journal (BuildJournal, optional): Journal recording the builds, builds it
+                already knows about are not submitted again
+            koji (KojiAPI, optional): Used to watch tasks not watched by a packager process
+            nowait (bool, optional): Let the packager exit once the task is submitted
+                and watch all tasks through koji
+            retry (RetryPolicy, optional): Policy for failed builds, failures are final if not set
+            durations (dict, optional): Expected build duration of components in seconds,
+                the longest builds are started first
+            history (BuildHistory, optional): Store the durations of successful builds are recorded in
+        """
+        self.packager = packager
+        self.workdir = workdir
+        self.max_parallel = max_parallel
+        self.custom_args = custom_args or []
+        self.logger = logger if logger else setup_logger("scheduler")
+        self.journal = journal
+        self.koji = koji
+        self.nowait = nowait
+        self.retry = retry
+        self.durations = durations or {}
+        self.history = history
+        self.selector = selectors.DefaultSelector()
+        self.logdir = os.path.join(workdir, "logs")
+        self._last_task_poll = 0
+        self._task_delay = self.task_poll_min
+        # Components whose latest build is up to date, they are not built again
+        self._unchanged = set()
+
+    def _record(self, build, state):
+        if self.journal:
+            self.journal.record(build, state)
+
+    def _queue(self, pending, builds, new):
+        for build in new:
+            entry = self.journal.get(build.component) if self.journal else None
+            if entry and entry["state"] in (SUCCEEDED, SUBMITTED):
+                # Kept until the build is launched, so a run interrupted before that can be resumed too
+                continue
+            self._record(build, QUEUED)
+        builds += new
+        pending.extend(new)
+
+    def _has_free_slot(self, running):
+        return not self.max_parallel or len(running) < self.max_parallel
+
+    def _expected(self, build):
+        """Returns the expected duration of a build, the average one if it is not known"""
+        if build.component in self._unchanged:
+            return 0
+        if build.component in self.durations:
+            return self.durations[build.component]
+        if self.durations:
+            return sum(self.durations.values()) / len(self.durations)
+        return 0
+
+    def _next(self, pending, builds, graph):
+        """Takes the longest queued build whose parents in this run have ended
+
+        Builds whose parent failed are skipped.
+
+        Returns:
+            Build: Build ready to be started, None if every queued build waits
+        """
+        for build in sorted(pending, key=self._expected, reverse=True):
+            if build.not_before > time.time():
+                continue
+            names = graph.get(build.component, []) if graph else []
+            parents = [b for b in builds if b.component in names]
+            if not all(p.finished or p.skipped for p in parents):
+                continue
+            pending.remove(build)
+            failed = [p.component for p in parents if not p.succeeded]
+            if failed:
+                build.skipped = True
+                self.logger.error(f"Skipping {build.component}, its parent {', '.join(failed)} was not built")
+                continue
+            if parents:
+                build.parent = max(parents, key=lambda b: b.finished)
+            return build
+        return None
+
+    def _launch(self, build):
+        """Starts a build, reusing its state from the journal of a previous run"""
+        entry = self.journal.get(build.component) if self.journal else None
+        state = entry["state"] if entry else None
+        if state == SUCCEEDED:
+            self.logger.info(f"{build.component} was built in a previous run")
+            build.started = build.finished = time.time()
+            build.returncode = 0
+            build.resumed = True
+        elif state == SUBMITTED and entry["task_id"] and self.koji:
+            build.task_id = entry["task_id"]
+            build.started = time.time()
+            build.resumed = True
+            self._task_delay = self.task_poll_min
+            self.logger.info(f"Watching task {build.task_id} of {build.component} submitted in a previous run")
+        elif build.component in self._unchanged:
+            self.logger.info(f"{build.component} is already built from its current commit")
+            build.started = build.finished = time.time()
+            build.returncode = 0
+            build.resumed = True
+        else:
+            self._start(build)
+
+    def _start(self, build):
+        self.logger.info(f"Building image {build.component} ...")
+        args = [self.packager, "container-build"] + self.custom_args
+        if self.nowait:
+            args.append("--nowait")
+        build.proc = subprocess.Popen(args, cwd=os.path.join(self.workdir, build.component),
+                                      stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        build.started = time.time()
+        self.logger.debug(f"{build.component} started after {build.queue_wait:.1f}s in the queue")
+        os.makedirs(self.logdir, exist_ok=True)
+        build.log_path = os.path.join(self.logdir, build.component + ".log")
+        build.log = open(build.log_path, "wb")
+        for stream in (build.proc.stdout, build.proc.stderr):
+            os.set_blocking(stream.fileno(), False)
+            self.selector.register(stream, selectors.EVENT_READ, build)
+            build.streams.append(stream)
+
+    def _close(self, build, stream):
+        self.selector.unregister(stream)
+        stream.close()
+        build.streams.remove(stream)
+
+    def _read(self, build, stream):
+        """Reads available output of a build, closing the stream at its end
+
+        Returns:
+            bool: True if some output was read and more may follow
+        """
+        try:
+            data = os.read(stream.fileno(), self.read_size)
+        except BlockingIOError:
+            return False
+        if not data:
+            self._close(build, stream)
+            return False
+        build.log.write(data)
+        build.log.flush()
+        if stream is build.proc.stdout:
+            self._read_stdout(build, data)
+        else:
+            build.stderr = (build.stderr + data)[-self.tail_size:]
+        return True
+
+    def _read_stdout(self, build, data):
+        if build.task_id is not None:
+            return
+        *lines, build.stdout_line = (build.stdout_line + data).split(b"\n")
+        for line in lines:
+            match = re.search(rb"taskID=(\d+)", line)
+            if match:
+                build.task_id = int(match.group(1))
+                build.stdout_line = b""
+                self.logger.info(f"{build.component} - {line.decode(errors='replace').strip()}")
+                self._record(build, SUBMITTED)
+                return
+        build.stdout_line = build.stdout_line[-self.tail_size:]
+
+    def _reap(self, build):
+        # The build exited, but something it spawned might still hold the pipes
+        for stream in list(build.streams):
+            while self._read(build, stream):
+                pass
+            if stream in build.streams:
+                self._close(build, stream)
+        build.proc.wait()
+        build.log.close()
+        build.returncode = build.proc.returncode
+
+    def _detach(self, build):
+        """Hands a build submitted with --nowait over to the koji task watcher
+
+        Returns:
+            bool: True if the task is watched, False if the build has ended
+        """
+        if not self.nowait or build.proc is None:
+            return False
+        self._reap(build)
+        if build.returncode or build.task_id is None:
+            return False
+        build.proc = None
+        build.returncode = None
+        self._task_delay = self.task_poll_min
+        self.logger.debug(f"Watching task {build.task_id} of {build.component}")
+        return True
+
+    def _finish(self, build):
+        if build.proc is not None and build.returncode is None:
+            self._reap(build)
+        self._record(build, SUCCEEDED if build.succeeded else FAILED)
+        if build.finished is not None:
+            # Built in a previous run
+            return
+        build.finished = time.time()
+        if build.succeeded and self.history:
+            self.history.record(build.component, build.duration)
+        if build.task_id is None:
+            # The error gets printed out below
+            self.logger.warning(f"Could not find task for {build.component}!")
+        times = f"in {build.duration:.0f}s, queued for {build.queue_wait:.0f}s"
+        if build.succeeded:
+            self.logger.info(f"{build.component} build has finished {times}")
+        else:
+            self.logger.error(f"{build.component} build has failed {times}")
+        if build.stderr:
+            # Write out stderr if we encounter an error
+            self.logger.error(_4sp(build.stderr.decode(errors="replace")))
+            self.logger.error(f"Full output of the build is in {build.log_path}")
+
+    def estimate(self, pending, running, builds, graph=None):
+        """Estimates when the queued and running builds end
+
+        Builds are simulated in the order they would be started, using
+        their expected durations. Images not queued yet are not included.
+
+        Returns:
+            float: Expected time the last build ends at
+        """
+        now = time.time()
+        graph = graph or {}
+        ends = {b.component: b.finished or now for b in builds if b.finished or b.skipped}
+        slots = []
+        for build in running:
+            ends[build.component] = max(now, build.started + self._expected(build))
+            heapq.heappush(slots, ends[build.component])
+        queue = sorted(pending, key=self._expected, reverse=True)
+        # Parents not being built in this run are not waited for
+        waited = {b.component for b in queue} | set(ends)
+        clock = now
+        while queue:
+            ready = [b for b in queue
+                     if all(p in ends and ends[p] <= clock for p in graph.get(b.component, []) if p in waited)]
+            if ready and self._has_free_slot(slots):
+                build = ready[0]
+                queue.remove(build)
+                ends[build.component] = max(clock, build.not_before) + self._expected(build)
+                heapq.heappush(slots, ends[build.component])
+            elif slots:
+                clock = max(clock, heapq.heappop(slots))
+            else:
+                # The remaining builds wait for each other, the scheduler breaks the cycle
+                waited -= set(graph.get(queue[0].component, []))
+        return max([now] + list(ends.values()))
+
+    def _log_estimate(self, pending, running, builds, graph):
+        if not self.durations:
+            return
+        end = self.estimate(pending, running, builds, graph)
+        remaining = (end - time.time()) / 60
+        self.logger.info(f"Builds are expected to finish at {time.strftime('%H:%M', time.localtime(end))} "
+                         f"(in {remaining:.0f} minutes)")
+
+    def _retry(self, build):
+        """Returns the next attempt of a failed build, None if it is not retried"""
+        if build.succeeded or not self.retry or build.attempt >= self.retry.max_attempts:
+            return None
+        if not self.retry.is_transient(build.stderr.decode(errors="replace")):
+            return None
+        delay = self.retry.get_delay(build.attempt)
+        retry = Build(build.image, parent=build.parent)
+        retry.attempt = build.attempt + 1
+        retry.queued = build.queued
+        retry.not_before = time.time() + delay
+        self.logger.warning(f"Failure of {build.component} looks transient, retrying in {delay:.0f}s "
+                            f"(attempt {retry.attempt} of {self.retry.max_attempts})")
+        return retry
+
+    def _wait(self, running, until=None):
+        """Reads output of the running builds until at least one of them ends
+
+        Args:
+            running (list of Build): Running builds
+            until (float, optional): Time to stop waiting at even if no build has ended
+
+        Returns:
+            list of Build: Builds that have ended
+        """
+        events = True
+        while True:
+            ended = [build for build in running
+                     if build.done or (not events and build.proc and build.proc.poll() is not None)]
+            if ended or (until and time.time() >= until):
+                return ended
+            watched = [build for build in running if build.proc is None]
+            timeout = self.poll_interval
+            if until:
+                timeout = max(0, min(timeout, until - time.time()))
+            if watched:
+                timeout = max(0, min(timeout, self._last_task_poll + self._task_delay - time.time()))
+            events = self.selector.select(timeout=timeout)
+            for key, _ in events:
+                self._read(key.data, key.fileobj)
+            if watched and time.time() >= self._last_task_poll + self._task_delay:
+                self._poll_tasks(watched)
+
+    def _poll_tasks(self, watched):
+        """Sets the return code of builds whose koji task has ended
+
+        All tasks are checked in a single batch, the next check is delayed
+        more each time none of them ends or the hub cannot be reached.
+        """
+        self._last_task_poll = time.time()
+        try:
+            states = self.koji.get_task_states([build.task_id for build in watched])
+        except (xmlrpc.client.Error, http.client.HTTPException, OSError) as e:
+            # The tasks keep running in koji, they are checked again later
+            self.logger.warning(f"Could not check the state of koji tasks: {e}")
+            self._task_delay = min(self._task_delay * 2, self.task_poll_interval)
+            return
+        for build in watched:
+            state = states.get(build.task_id)
+            if state == TASK_CLOSED:
+                build.returncode = 0
+            elif state in (TASK_CANCELED, TASK_FAILED):
+                build.returncode = 1
+        if any(build.done for build in watched):
+            self._task_delay = self.task_poll_min
+        else:
+            self._task_delay = min(self._task_delay * 2, self.task_poll_interval)
+
+    def _check_unchanged(self, unchanged, images):
+        if unchanged and images:
+            self._unchanged |= set(unchanged(images))
+
+    def run(self, images, triggered=None, graph=None, unchanged=None):
+        """Builds the images
+
+        Images returned by triggered are queued as soon as the build
+        triggering them succeeds, so dependent layers do not wait for
+        unrelated builds. Images found in graph are started once all of
+        their parents being built in this run have succeeded.
+        Images reported by unchanged succeed without being built,
+        the images they trigger are still queued.
+
+        Args:
+            images (list): Images to be built, in the order they are started
+            triggered (callable, optional): Called with each successful Build,
+                returns a list of images depending on it
+            graph (dict, optional): Components mapped to the components they are built from
+            unchanged (callable, optional): Called with the images being queued,
+                returns the components that do not need to be built again
+
+        Returns:
+            list of Build: Finished builds in the order they finished
+        """
+        builds = []
+        pending = deque()
+        self._check_unchanged(unchanged, images)
+        self._queue(pending, builds, [Build(image) for image in images])
+        running = []
+        finished = []
+        self.logger.info("Waiting for builds...")
+        self._log_estimate(pending, running, builds, graph)
+        while pending or running:
+            while pending and self._has_free_slot(running):
+                build = self._next(pending, builds, graph)
+                retries = [b.not_before for b in pending if b.not_before > time.time()]
+                if build is None and not running and pending and not retries:
+                    # Nothing is running that could unblock the queue, the graph has a cycle
+                    build = pending.popleft()
+                    self.logger.warning(f"Dependency cycle detected, building {build.component} anyway")
+                if build is None:
+                    break
+                self._launch(build)
+                running.append(build)
+            # Wake up when the next retry may start
+            until = min((b.not_before for b in pending if b.not_before > time.time()), default=None)
+            if not running:
+                if until:
+                    time.sleep(max(0, until - time.time()))
+                # Otherwise only skipped builds were left
+                continue
+            for build in self._wait(running, until):
+                if self._detach(build):
+                    continue
+                self._finish(build)
+                running.remove(build)
+                retry = self._retry(build)
+                if retry:
+                    builds.remove(build)
+                    self._queue(pending, builds, [retry])
+                    continue
+                finished.append(build)
+                if build.succeeded and triggered:
+                    new = [Build(image, parent=build) for image in triggered(build)]
+                    if new:
+                        self._check_unchanged(unchanged, [b.image for b in new])
+                        self._queue(pending, builds, new)
+                        self._log_estimate(pending, running, builds, graph)
+        return finished
+
+    def report(self, builds):
+        """Logs the critical path of the finished builds
+
+        The critical path is the chain of triggered builds that ended last,
+        it determines how long the whole run takes.
+
+        Args:
+            builds (list of Build): Finished builds as returned by run()
+        """
+        if not builds:
+            return
+        last = max(builds, key=lambda b: b.finished)
+        chain = last.chain
+        total = last.finished - chain[0].queued
+        busy = sum(b.duration for b in builds)
+        self.logger.info(f"Built {len(builds)} images in {total:.0f}s, {busy:.0f}s of build time")
+        self.logger.info("Critical path:")
+        for build in chain:
+            self.logger.info(_4sp(f"{build.component}: {build.duration:.0f}s "
+                                  f"(queued for {build.queue_wait:.0f}s)"))
+        retried = [build for build in builds if build.attempt > 1]
+        if retried:
+            self.logger.info("Retried builds:")
+        for build in retried:
+            result = "succeeded" if build.succeeded else "failed"
+            self.logger.info(_4sp(f"{build.component}: {result} after {build.attempt} attempts"))
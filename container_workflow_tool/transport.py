@@ -0,0 +1,205 @@
+# MIT License
+#
+# Copyright (c) 2023 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import zlib
+import threading
+import contextlib
+import http.client
+import xmlrpc.client
+
+# Size of the chunks read from the hub responses
+CHUNK_SIZE = 64 * 1024
+
+
+class ProjectingUnmarshaller(xmlrpc.client.Unmarshaller):
+    """Unmarshaller keeping only the given members of every struct.
+
+    Members are dropped as soon as their struct is parsed, so large
+    responses never have to be held in memory as a whole. Kept members
+    are expected to be scalar values.
+    """
+
+    def __init__(self, fields, **kwargs):
+        super(ProjectingUnmarshaller, self).__init__(**kwargs)
+        # Faults are structs as well
+        self.fields = set(fields) | {"faultCode", "faultString"}
+
+    def end_struct(self, data):
+        mark = self._marks.pop()
+        items = self._stack[mark:]
+        self._stack[mark:] = [{items[i]: items[i + 1] for i in range(0, len(items), 2)
+                               if items[i] in self.fields}]
+        self._value = 0
+
+    dispatch = dict(xmlrpc.client.Unmarshaller.dispatch)
+    dispatch["struct"] = end_struct
+
+
+class PooledTransport(xmlrpc.client.Transport):
+    """Thread-safe XML-RPC transport keeping a pool of persistent connections.
+
+    Requests larger than encode_threshold are gzip compressed and gzip
+    encoded responses are accepted. Responses are decompressed and parsed
+    while they are being read.
+    """
+
+    def __init__(self, scheme="https", timeout=None, pool_size=8, context=None):
+        """
+        Args:
+            scheme (str, optional): Either https or http
+            timeout (float, optional): Socket timeout of every call in seconds
+            pool_size (int, optional): Maximum number of idle connections kept open
+            context (ssl.SSLContext, optional): SSL context used for https
+        """
+        super(PooledTransport, self).__init__()
+        self.scheme = scheme
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.context = context
+        self.encode_threshold = 1400
+        self._pool = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.requests = 0
+        self.connections = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    @contextlib.contextmanager
+    def projection(self, fields):
+        """Keeps only the given struct members in responses parsed by this thread"""
+        self._local.fields = fields
+        try:
+            yield
+        finally:
+            self._local.fields = None
+
+    def thread_bytes_received(self):
+        """Returns the number of response bytes read by the calling thread"""
+        return getattr(self._local, "bytes_received", 0)
+
+    def getparser(self):
+        fields = getattr(self._local, "fields", None)
+        if fields is None:
+            return super(PooledTransport, self).getparser()
+        target = ProjectingUnmarshaller(fields, use_datetime=self._use_datetime,
+                                        use_builtin_types=self._use_builtin_types)
+        return xmlrpc.client.ExpatParser(target), target
+
+    def _new_connection(self, host):
+        chost, _, x509 = self.get_host_info(host)
+        with self._lock:
+            self.connections += 1
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(chost, timeout=self.timeout,
+                                               context=self.context, **(x509 or {}))
+        return http.client.HTTPConnection(chost, timeout=self.timeout)
+
+    def _acquire(self, host):
+        with self._lock:
+            idle = self._pool.get(host)
+            if idle:
+                return idle.pop()
+        return self._new_connection(host)
+
+    def _release(self, host, conn):
+        with self._lock:
+            idle = self._pool.setdefault(host, [])
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, {}
+        for idle in pool.values():
+            for conn in idle:
+                conn.close()
+
+    def request(self, host, handler, request_body, verbose=False):
+        # Retry once on a fresh connection if a pooled one has gone cold
+        for attempt in (0, 1):
+            conn = self._acquire(host) if not attempt else self._new_connection(host)
+            try:
+                result = self._single_request(conn, host, handler, request_body)
+            except xmlrpc.client.Fault:
+                # The whole response has been read, the connection is still usable
+                self._release(host, conn)
+                raise
+            except (http.client.RemoteDisconnected, ConnectionResetError,
+                    ConnectionAbortedError, BrokenPipeError):
+                conn.close()
+                if attempt:
+                    raise
+                continue
+            except Exception:
+                conn.close()
+                raise
+            self._release(host, conn)
+            return result
+
+    def _single_request(self, conn, host, handler, request_body):
+        if conn.sock is not None:
+            conn.sock.settimeout(self.timeout)
+        _, extra_headers, _ = self.get_host_info(host)
+        conn.putrequest("POST", handler, skip_accept_encoding=True)
+        for key, val in (extra_headers or []) + self._headers:
+            conn.putheader(key, val)
+        conn.putheader("Accept-Encoding", "gzip")
+        conn.putheader("Content-Type", "text/xml")
+        conn.putheader("User-Agent", self.user_agent)
+        if self.encode_threshold is not None and len(request_body) > self.encode_threshold:
+            conn.putheader("Content-Encoding", "gzip")
+            request_body = xmlrpc.client.gzip_encode(request_body)
+        conn.putheader("Content-Length", str(len(request_body)))
+        conn.endheaders(request_body)
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += len(request_body)
+
+        resp = conn.getresponse()
+        if resp.status != 200:
+            resp.read()
+            raise xmlrpc.client.ProtocolError(host + handler, resp.status,
+                                              resp.reason, dict(resp.getheaders()))
+        return self.parse_response(resp)
+
+    def parse_response(self, response):
+        decoder = None
+        if response.getheader("Content-Encoding", "") == "gzip":
+            decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        p, u = self.getparser()
+        received = 0
+        while True:
+            data = response.read(CHUNK_SIZE)
+            if not data:
+                break
+            received += len(data)
+            p.feed(decoder.decompress(data) if decoder else data)
+        if decoder:
+            p.feed(decoder.flush())
+        with self._lock:
+            self.bytes_received += received
+        self._local.bytes_received = self.thread_bytes_received() + received
+        p.close()
+        return u.close()
@@ -37,6 +37,17 @@ def flatten_list(input_list):
     return flattened
 
 
+def _non_negative_int(value):
+    """Argument type of counts where 0 has a special meaning, e.g. unlimited"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'")
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must not be negative: {number}")
+    return number
+
+
 def _transform_verbosity(value):
     return ((value - 6) * -10)
 
@@ -65,6 +76,12 @@ def _get_hostname_url(config) -> str:
     return git_url
 
 
+def _get_cache_dir() -> str:
+    # Persistent data shared between runs, honors the XDG base directory spec
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(Path.home(), ".cache")
+    return os.path.join(cache_home, "cwt")
+
+
 def _split_config_path(config: str):
     conf = config.split(':')
     if len(conf) > 2:
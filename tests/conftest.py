@@ -20,15 +20,30 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import os
 import pytest
 import json
+from pathlib import Path
 
 import tempfile
 
+from git import Repo
 
 from tests.spellbook import DATA_DIR
 
 
+@pytest.fixture(scope="session", autouse=True)
+def cache_home(tmp_path_factory):
+    # Keep persistent caches of the test suite away from the user ones
+    old = os.environ.get("XDG_CACHE_HOME")
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path_factory.mktemp("cache"))
+    yield os.environ["XDG_CACHE_HOME"]
+    if old is None:
+        del os.environ["XDG_CACHE_HOME"]
+    else:
+        os.environ["XDG_CACHE_HOME"] = old
+
+
 @pytest.fixture()
 def brewapi_get_nvrs():
     return [
@@ -71,5 +86,35 @@ def brewapi_list_archives_python3():
     return json.loads((DATA_DIR / "brewapi_list_archives_python3.json").read_text())
 
 
+@pytest.fixture()
+def fake_packager(tmp_path):
+    """Returns a function setting up dist-git directories built by the fake packager"""
+    def setup(component, build_time=0, exit_code=0, stderr=None):
+        path = tmp_path / component
+        path.mkdir(exist_ok=True)
+        (path / "build-time").write_text(str(build_time))
+        (path / "build-exit").write_text(str(exit_code))
+        if stderr is not None:
+            (path / "build-stderr").write_text(stderr)
+        return {"component": component, "name": component}
+    setup.packager = str(DATA_DIR / "fake-packager.sh")
+    setup.workdir = str(tmp_path)
+    return setup
+
+
+@pytest.fixture()
+def distgit_remote(tmp_path):
+    """Returns a function creating dist-git repositories served from a local directory"""
+    def create(component, branch="main"):
+        repo = Repo.init(tmp_path / "remote" / "container" / f"{component}.git")
+        (Path(repo.working_dir) / "Dockerfile").write_text(f"FROM fedora\nLABEL name={component}\n")
+        repo.index.add(["Dockerfile"])
+        repo.index.commit("Initial commit")
+        repo.git.branch("-M", branch)
+        return repo
+    create.url = (tmp_path / "remote").as_uri()
+    return create
+
+
 def get_tmp_workdir():
     return tempfile.TemporaryDirectory()
@@ -0,0 +1,19 @@
+#!/bin/bash
+# Stand-in for fedpkg container-build used by the scheduler tests.
+# The build is controlled by files in the dist-git directory:
+#   build-time   - seconds the build takes
+#   build-exit   - exit code of the build
+#   build-stderr - text written to stderr before exiting
+# With --nowait it exits right after submitting the task.
+echo "Created task: $$"
+echo "Task info: https://koji.fedoraproject.org/koji/taskinfo?taskID=$$"
+for arg in "$@"; do
+    if [ "$arg" = "--nowait" ]; then
+        exit 0
+    fi
+done
+sleep "$(cat build-time 2>/dev/null || echo 0)"
+if [ -f build-stderr ]; then
+    cat build-stderr >&2
+fi
+exit "$(cat build-exit 2>/dev/null || echo 0)"
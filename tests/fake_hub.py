@@ -0,0 +1,179 @@
+# MIT License
+#
+# Copyright (c) 2023 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+In-process stand-in for the koji hub
+
+Serves the hub calls used by KojiAPI over XML-RPC from the fixture data
+in the data directory and from synthetic images derived from it.
+A latency can be injected into every HTTP request to mimic a remote hub.
+"""
+
+import copy
+import json
+import time
+import threading
+import collections
+import xmlrpc.client
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+from tests.spellbook import DATA_DIR
+
+TAG = "fake-container-candidate"
+
+
+class _Handler(SimpleXMLRPCRequestHandler):
+    # Keep connections alive like the real hub does
+    protocol_version = "HTTP/1.1"
+    rpc_paths = ("/kojihub",)
+
+    def do_POST(self):
+        self.server.hub.count_request()
+        if self.server.hub.latency:
+            time.sleep(self.server.hub.latency)
+        super(_Handler, self).do_POST()
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+class FakeKojiHub(object):
+    """Fake koji hub running in a background thread"""
+
+    def __init__(self, images=0, releases=1, latency=0.0):
+        """
+        Args:
+            images (int, optional): Number of synthetic images to serve
+            releases (int, optional): Number of builds tagged for every synthetic image
+            latency (float, optional): Seconds every HTTP request is delayed by
+        """
+        self.latency = latency
+        self.requests = 0
+        self.calls = collections.Counter()
+        self.images = []
+        self._builds = {}
+        self._archives = {}
+        self._tagged = collections.defaultdict(list)
+        self._lock = threading.Lock()
+        for name in ("s2i_core", "s2i_base", "python3"):
+            buildinfo = json.loads((DATA_DIR / f"brewapi_get_buildinfo_{name}.json").read_text())
+            archive = json.loads((DATA_DIR / f"brewapi_list_archives_{name}.json").read_text())
+            self.add_build(buildinfo, [archive])
+        self._add_synthetic(images, releases)
+
+        self.server = _Server(("127.0.0.1", 0), requestHandler=_Handler,
+                              allow_none=True, logRequests=False)
+        self.server.hub = self
+        for method in ("getLatestBuilds", "listTagged", "getBuild", "listArchives",
+                       "getLastEvent", "multiCall"):
+            self.server.register_function(self._counted(method), method)
+        self.server.register_multicall_functions()
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/kojihub".format(self.server.server_address[1])
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.calls.clear()
+
+    def _counted(self, method):
+        func = getattr(self, method)
+
+        def call(*params):
+            with self._lock:
+                self.calls[method] += 1
+            # Keyword arguments are encoded by koji as a trailing dict
+            if params and isinstance(params[-1], dict) and params[-1].pop("__starstar", False):
+                return func(*params[:-1], **params[-1])
+            return func(*params)
+        return call
+
+    def add_build(self, buildinfo, archives, tag=TAG):
+        """Serves a build with its archives, tagged into tag"""
+        self._builds[buildinfo["nvr"]] = buildinfo
+        self._archives[buildinfo["build_id"]] = archives
+        self._tagged[(tag, buildinfo["name"])].append(buildinfo)
+
+    def _add_synthetic(self, images, releases):
+        buildinfo = json.loads((DATA_DIR / "brewapi_get_buildinfo_s2i_base.json").read_text())
+        archive = json.loads((DATA_DIR / "brewapi_list_archives_s2i_base.json").read_text())
+        for i in range(images):
+            component = f"image{i}"
+            for release in range(1, releases + 1):
+                build_id = 10000000 + i * 1000 + release
+                info = copy.deepcopy(buildinfo)
+                info.update(name=component, package_name=component, build_id=build_id, id=build_id, epoch=None,
+                            release=f"{release}.container", nvr=f"{component}-1-{release}.container")
+                arch = copy.deepcopy(archive)
+                arch.update(build_id=build_id)
+                arch["extra"]["docker"]["config"]["config"]["Labels"]["name"] = f"fake/{component}"
+                self.add_build(info, [arch])
+            self.images.append({"name": component, "component": component, "build_tag": TAG})
+
+    # Hub API
+    def getLatestBuilds(self, tag, event=None, package=None, type=None):
+        builds = self._tagged.get((tag, package), [])
+        return builds[-1:]
+
+    def listTagged(self, tag, event=None, inherit=False, prefix=None, latest=False, package=None, *args):
+        return self._tagged.get((tag, package), [])
+
+    def getBuild(self, nvr):
+        return self._builds.get(nvr)
+
+    def listArchives(self, build_id, *args):
+        return self._archives.get(build_id, [])
+
+    def getLastEvent(self):
+        return {"id": 1, "ts": 0.0}
+
+    def multiCall(self, calls):
+        results = []
+        for call in calls:
+            try:
+                method = self.server.funcs[call["methodName"]]
+                results.append([method(*call["params"])])
+            except xmlrpc.client.Fault as e:
+                results.append({"faultCode": e.faultCode, "faultString": e.faultString})
+            except Exception as e:
+                results.append({"faultCode": 1, "faultString": "{}: {}".format(type(e).__name__, e)})
+        return results
@@ -0,0 +1,144 @@
+# MIT License
+#
+# Copyright (c) 2023 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+
+import pytest
+from flexmock import flexmock
+
+from container_workflow_tool.cli import ImageRebuilder
+from container_workflow_tool.cache import KojiCache
+from container_workflow_tool.koji import BUILD_FIELDS, KojiAPI
+from tests.fake_hub import FakeKojiHub
+
+
+def setup_rebuilder(hub, tmp_path):
+    ir = ImageRebuilder("Testing")
+    # Every rebuilder adds handlers to the same logger, bound to the output
+    # captured for the test creating it. Only the timing lines get printed.
+    for handler in list(ir.logger.handlers):
+        ir.logger.removeHandler(handler)
+    ir.set_config("default.yaml", release="rawhide")
+    ir.conf["koji_url"] = hub.url
+    ir.brewapi.cache = KojiCache(str(tmp_path / "koji.sqlite"))
+    flexmock(ir).should_receive("_get_images").and_return(hub.images)
+    return ir
+
+
+class TestFakeHub(object):
+
+    def test_get_nvrs(self, tmp_path):
+        with FakeKojiHub(images=25) as hub:
+            ir = setup_rebuilder(hub, tmp_path)
+            nvrs = ir.brewapi.get_nvrs(hub.images)
+            assert [nvr for nvr, _, _ in nvrs] == [f"image{i}-1-1.container" for i in range(25)]
+            assert hub.requests == 1
+            assert hub.calls["getLatestBuilds"] == 25
+
+    def test_persistent_cache_new_client(self, tmp_path):
+        with FakeKojiHub(images=5) as hub:
+            ir = setup_rebuilder(hub, tmp_path)
+            # Every run of cwt starts with a new client
+            for _ in range(2):
+                brewapi = KojiAPI(ir.conf, ir.logger, cache_path=str(tmp_path / "koji.sqlite"))
+                nvrs = brewapi.get_nvrs(hub.images)
+            assert [nvr for nvr, _, _ in nvrs] == [f"image{i}-1-1.container" for i in range(5)]
+            assert hub.requests == 1
+            assert brewapi.cache.hits == 5
+
+    def test_latest_release(self, tmp_path):
+        with FakeKojiHub(images=3, releases=12) as hub:
+            ir = setup_rebuilder(hub, tmp_path)
+            ir.brewapi.latest_by_nvr = True
+            nvrs = ir.brewapi.get_nvrs(hub.images)
+            assert [nvr for nvr, _, _ in nvrs] == [f"image{i}-1-12.container" for i in range(3)]
+
+    def test_latest_release_projection(self, tmp_path):
+        with FakeKojiHub(images=1, releases=3) as hub:
+            ir = setup_rebuilder(hub, tmp_path)
+            ir.brewapi.latest_by_nvr = True
+            image = hub.images[0]
+            # The first hub call of the client keeps only the compared fields
+            builds = ir.brewapi._latest_builds([(image["build_tag"], image["component"])])[0]
+            assert len(builds) == 3
+            assert all(set(build) <= set(BUILD_FIELDS) for build in builds)
+            # The projected responses are cached apart from the complete ones
+            builds = ir.brewapi.get_all_builds(image["component"], image["build_tag"])
+            assert len(builds) == 3
+            assert all("completion_time" in build for build in builds)
+
+    def test_get_brew_builds(self, tmp_path):
+        with FakeKojiHub(images=25) as hub:
+            ir = setup_rebuilder(hub, tmp_path)
+            lines = list(ir.get_brew_builds())
+            assert len(lines) == 26
+            assert lines[1] == "|image0|image0-1-1.container|fake/image0:1-1.container|2021-07-23 04:30:36+00:00|1"
+            # A getBuild and a listArchives multicall for every chunk of ten builds
+            assert hub.requests == 1 + 3 * 2
+            # The second run is answered from the on-disk cache
+            hub.reset_counters()
+            ir.brewapi.nvrs = []
+            ir.brewapi.buildinfo = {}
+            assert list(ir.get_brew_builds()) == lines
+            assert hub.requests == 0
+
+
+@pytest.mark.benchmark
+class TestBenchmark(object):
+    """Measures KojiAPI request patterns against the fake hub
+
+    Run with: python3 -m pytest -m benchmark -s tests/test_benchmark.py
+    """
+
+    def _report(self, capsys, name, images, hub, start):
+        with capsys.disabled():
+            msg = "\n{:<16} images={:<5} latency={:.3f}s wall={:.3f}s http_requests={:<4} calls={}"
+            print(msg.format(name, images, hub.latency, time.time() - start, hub.requests,
+                             sum(hub.calls.values())))
+
+    @pytest.mark.parametrize("images", [10, 100, 1000])
+    @pytest.mark.parametrize("latency", [0.0, 0.05])
+    def test_get_nvrs(self, capsys, tmp_path, images, latency):
+        with FakeKojiHub(images=images, latency=latency) as hub:
+            ir = setup_rebuilder(hub, tmp_path)
+            start = time.time()
+            ir.brewapi.get_nvrs(hub.images)
+            self._report(capsys, "get_nvrs", images, hub, start)
+
+    @pytest.mark.parametrize("images", [10, 100, 1000])
+    @pytest.mark.parametrize("latency", [0.0, 0.05])
+    def test_get_brew_builds(self, capsys, tmp_path, images, latency):
+        with FakeKojiHub(images=images, latency=latency) as hub:
+            ir = setup_rebuilder(hub, tmp_path)
+            start = time.time()
+            for _ in ir.get_brew_builds():
+                pass
+            self._report(capsys, "get_brew_builds", images, hub, start)
+
+    @pytest.mark.parametrize("images", [10, 100, 1000])
+    @pytest.mark.parametrize("latency", [0.0, 0.05])
+    def test_hash_ids(self, capsys, tmp_path, images, latency):
+        with FakeKojiHub(images=images, latency=latency) as hub:
+            ir = setup_rebuilder(hub, tmp_path)
+            start = time.time()
+            ir.get_hash_ids()
+            self._report(capsys, "hash_ids", images, hub, start)
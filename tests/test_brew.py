@@ -20,9 +20,14 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import time
 import pytest
+import threading
+import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
 
 from container_workflow_tool.cli import ImageRebuilder
+from container_workflow_tool.koji import KojiAPI, _rpmvercmp
 
 
 class TestBrew(object):
@@ -53,3 +58,240 @@ class TestBrew(object):
         taskinfo = self.ir.brewapi.get_taskinfo(24268996)
         assert taskinfo['create_ts']
         assert taskinfo['create_ts'] == 1516286326.921902
+
+
+class FakeMulticallHub(object):
+    """Stand-in for the koji hub answering multicall requests"""
+
+    def __init__(self, builds):
+        self.builds = builds
+        self.batches = []
+        self.event = 100
+        self.history = []
+
+    def getLastEvent(self):
+        return {"id": self.event}
+
+    def getFullInheritance(self, tag):
+        return [{"name": "f35-container-updates"}]
+
+    def queryHistory(self, opts):
+        entries = [{"name": name} for event, tag, name in self.history
+                   if tag == opts["tag"] and event > opts["afterEvent"]]
+        return {"tag_listing": entries, "tag_inheritance": []}
+
+    def tag(self, tag, component, nvr):
+        self.event += 1
+        self.builds[component] = [{"nvr": nvr}]
+        self.history.append((self.event, tag, component))
+
+    def multiCall(self, calls):
+        self.batches.append(calls)
+        results = []
+        for call in calls:
+            try:
+                results.append([getattr(self, call["methodName"])(*call["params"])])
+            except xmlrpc.client.Fault as e:
+                results.append({"faultCode": e.faultCode, "faultString": e.faultString})
+        return results
+
+    def listTagged(self, tag, event, inherit, prefix, latest, component):
+        return self.builds[component]
+
+    def getLatestBuilds(self, tag, event, component):
+        if component not in self.builds:
+            raise xmlrpc.client.Fault(1000, "No such package")
+        return self.builds[component]
+
+    def getBuild(self, nvr):
+        return {"build_id": len(nvr), "nvr": nvr, "state": 1,
+                "source": "https://src.fedoraproject.org/container/image.git#commit-of-" + nvr,
+                "start_ts": 1627014386.0, "completion_ts": 1627014386.0 + len(nvr)}
+
+    def listArchives(self, build_id):
+        return [{"build_id": build_id}]
+
+    def getTaskInfo(self, task_id):
+        if task_id < 0:
+            raise xmlrpc.client.Fault(1000, "No such task")
+        return {"id": task_id, "state": task_id % 6}
+
+
+class TestBrewMulticall(object):
+    def setup_method(self):
+        self.ir = ImageRebuilder('Testing')
+        self.ir.set_config('default.yaml', release="rawhide")
+        builds = {
+            "s2i-core": [{"nvr": "s2i-core-0-51.container"}],
+            "s2i-base": [{"nvr": "s2i-base-1-63.container"}],
+            "nginx": [],
+        }
+        self.hub = FakeMulticallHub(builds)
+        self.ir.brewapi.brew = self.hub
+
+    def teardown_method(self):
+        self.ir.brewapi.clear_cache()
+
+    def _images(self, components):
+        return [{"name": c, "component": c, "build_tag": "f35-container-candidate"}
+                for c in components]
+
+    def test_get_nvrs_multicall(self):
+        images = self._images(["s2i-core", "nginx", "postgresql", "s2i-base"])
+        nvrs = self.ir.brewapi.get_nvrs(images)
+        assert nvrs == [
+            ("s2i-core-0-51.container", "s2i-core", "s2i-core"),
+            (None, "nginx", "nginx"),
+            (None, "postgresql", "postgresql"),
+            ("s2i-base-1-63.container", "s2i-base", "s2i-base"),
+        ]
+        assert len(self.hub.batches) == 1
+
+    def test_get_nvrs_multicall_chunks(self):
+        self.ir.conf["koji_multicall_size"] = 3
+        images = self._images(["s2i-core", "s2i-base", "nginx", "httpd", "mariadb", "perl", "php", "ruby"])
+        nvrs = self.ir.brewapi.get_nvrs(images)
+        assert [len(batch) for batch in self.hub.batches] == [3, 3, 2]
+        assert [nvr for nvr, _, _ in nvrs] == ["s2i-core-0-51.container", "s2i-base-1-63.container"] + [None] * 6
+
+    def test_get_nvrs_deduplicated(self):
+        images = self._images(["s2i-core", "s2i-base"] * 4)
+        nvrs = self.ir.brewapi.get_nvrs(images)
+        assert [len(batch) for batch in self.hub.batches] == [2]
+        assert [nvr for nvr, _, _ in nvrs] == ["s2i-core-0-51.container",
+                                               "s2i-base-1-63.container"] * 4
+
+    def test_multicall_single_flight(self):
+        started = threading.Event()
+        release = threading.Event()
+        multicall = self.hub.multiCall
+
+        def slow_multicall(calls):
+            started.set()
+            release.wait(5)
+            return multicall(calls)
+        self.hub.multiCall = slow_multicall
+        calls = [("getBuild", ("s2i-base-1-63.container",)), ("getBuild", ("s2i-core-0-51.container",))]
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            first = executor.submit(self.ir.brewapi._multicall, calls[:1])
+            started.wait(5)
+            # The call in flight is shared instead of being sent again
+            second = threading.Thread(target=lambda: results.append(self.ir.brewapi._multicall(calls)))
+            results = []
+            second.start()
+            time.sleep(0.1)
+            release.set()
+            second.join(5)
+            assert first.result() == results[0][:1]
+        assert [len(batch) for batch in self.hub.batches] == [1, 1]
+
+    def test_multicall_missing_results(self):
+        started = threading.Event()
+        release = threading.Event()
+        multicall = self.hub.multiCall
+
+        def truncated_multicall(calls):
+            started.set()
+            release.wait(5)
+            return multicall(calls)[:-1]
+        self.hub.multiCall = truncated_multicall
+        calls = [("getBuild", ("s2i-base-1-63.container",)), ("getBuild", ("s2i-core-0-51.container",))]
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            first = executor.submit(self.ir.brewapi._multicall, calls)
+            started.wait(5)
+            # Shares both calls in flight
+            second = executor.submit(self.ir.brewapi._multicall, calls[1:])
+            time.sleep(0.1)
+            release.set()
+            with pytest.raises(xmlrpc.client.ResponseError):
+                first.result(5)
+            # Fails instead of waiting for the result forever
+            with pytest.raises(xmlrpc.client.ResponseError):
+                second.result(5)
+        assert not self.ir.brewapi._inflight
+
+    def test_get_nvrs_persistent_cache(self):
+        images = self._images(["s2i-core", "s2i-base"])
+        first = self.ir.brewapi.get_nvrs(images)
+        # A new KojiAPI instance is answered from the on-disk cache
+        brewapi = KojiAPI(self.ir.conf, None)
+        brewapi.brew = self.hub
+        assert brewapi.get_nvrs(images) == first
+        assert len(self.hub.batches) == 1
+        assert brewapi.cache.hits == 2
+
+    def test_get_source_commits(self):
+        images = self._images(["s2i-core", "nginx", "s2i-base"])
+        commits = self.ir.brewapi.get_source_commits(images)
+        assert commits == {
+            "s2i-core": "commit-of-s2i-core-0-51.container",
+            "nginx": None,
+            "s2i-base": "commit-of-s2i-base-1-63.container",
+        }
+        # One multicall for the latest builds and one for their build info
+        assert len(self.hub.batches) == 2
+
+    def test_get_build_durations(self):
+        images = self._images(["s2i-core", "nginx", "s2i-base"])
+        durations = self.ir.brewapi.get_build_durations(images)
+        assert durations == {"s2i-core": len("s2i-core-0-51.container"), "s2i-base": len("s2i-base-1-63.container")}
+
+    def test_get_task_states(self):
+        assert self.ir.brewapi.get_task_states([8, 13, -1]) == {8: 2, 13: 1, -1: None}
+        assert len(self.hub.batches) == 1
+
+    def test_iter_builds(self):
+        items = [("nvr-{}-1.container".format("x" * i), "name", "component") for i in range(25)]
+        result = list(self.ir.brewapi.iter_builds(items, chunk_size=10))
+        assert [item for item, _, _ in result] == items
+        for item, buildinfo, archives in result:
+            assert buildinfo["nvr"] == item[0]
+            assert archives == [{"build_id": buildinfo["build_id"]}]
+        # One getBuild and one listArchives multicall per chunk
+        assert len(self.hub.batches) == 6
+
+    def test_get_nvr_changes(self):
+        images = self._images(["s2i-core", "s2i-base", "nginx"])
+        changes = self.ir.brewapi.get_nvr_changes(images)
+        assert changes == [
+            (None, "s2i-core-0-51.container", "s2i-core", "s2i-core"),
+            (None, "s2i-base-1-63.container", "s2i-base", "s2i-base"),
+        ]
+        assert self.ir.brewapi.get_nvr_changes(images) == []
+        # A build tagged into an inherited tag is found too
+        self.hub.tag("f35-container-updates", "s2i-base", "s2i-base-1-64.container")
+        self.hub.batches = []
+        changes = self.ir.brewapi.get_nvr_changes(images)
+        assert changes == [("s2i-base-1-63.container", "s2i-base-1-64.container", "s2i-base", "s2i-base")]
+        # Only the moved component has been resolved again
+        latest = [c for batch in self.hub.batches for c in batch if c["methodName"] == "getLatestBuilds"]
+        assert len(latest) == 1
+
+    def test_get_nvr_latest_release(self):
+        releases = ["9.el8", "51.el8", "10.el8", "51.el8~rc1"]
+        self.hub.builds["s2i-base"] = [{"nvr": "s2i-base-1-" + r, "epoch": None, "version": "1",
+                                        "release": r} for r in releases]
+        self.ir.brewapi.latest_by_nvr = True
+        nvr = self.ir.brewapi.get_nvr("f35-container-candidate", "s2i-base")
+        assert nvr == "s2i-base-1-51.el8"
+
+
+@pytest.mark.parametrize(
+    "a,b,expected",
+    [
+        ("1.0", "1.0", 0),
+        ("51.el8", "9.el8", 1),
+        ("10", "9", 1),
+        ("1.0", "1.0.1", -1),
+        ("1.0a", "1.0", 1),
+        ("1.0~rc1", "1.0", -1),
+        ("1.0^git1", "1.0", 1),
+        ("1.0^git1", "1.0.1", -1),
+        ("2.a", "2.1", -1),
+        ("1_0", "1.0", 0),
+        ("63.container", "51.container", 1),
+    ]
+)
+def test_rpmvercmp(a, b, expected):
+    assert _rpmvercmp(a, b) == expected
+    assert _rpmvercmp(b, a) == -expected
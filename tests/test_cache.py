@@ -0,0 +1,71 @@
+# MIT License
+#
+# Copyright (c) 2023 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+
+from flexmock import flexmock
+
+from container_workflow_tool.cache import KojiCache, BuildHistory
+
+
+class TestKojiCache(object):
+
+    def test_get_set(self, tmp_path):
+        cache = KojiCache(str(tmp_path / "koji.sqlite"))
+        assert cache.get("getBuild", ("s2i-base-1-63.container",)) is None
+        cache.set("getBuild", ("s2i-base-1-63.container",), {"build_id": 1798434})
+        assert cache.get("getBuild", ("s2i-base-1-63.container",)) == {"build_id": 1798434}
+        assert cache.get("getBuild", ("s2i-core-0-51.container",)) is None
+        assert (cache.hits, cache.misses) == (1, 2)
+
+    def test_persistent(self, tmp_path):
+        path = str(tmp_path / "koji.sqlite")
+        KojiCache(path).set("listArchives", (1798434,), [{"id": 1}])
+        assert KojiCache(path).get("listArchives", (1798434,)) == [{"id": 1}]
+
+    def test_ttl(self, tmp_path):
+        cache = KojiCache(str(tmp_path / "koji.sqlite"))
+        cache.set("getLatestBuilds", ("f35-container-candidate", None, "nginx"), [], ttl=60)
+        assert cache.get("getLatestBuilds", ("f35-container-candidate", None, "nginx")) == []
+        later = time.time() + 61
+        flexmock(time).should_receive("time").and_return(later)
+        assert cache.get("getLatestBuilds", ("f35-container-candidate", None, "nginx")) is None
+
+    def test_purge(self, tmp_path):
+        path = tmp_path / "koji.sqlite"
+        cache = KojiCache(str(path))
+        cache.set("getBuild", ("s2i-base-1-63.container",), {"build_id": 1798434})
+        cache.purge()
+        assert not path.exists()
+        assert cache.get("getBuild", ("s2i-base-1-63.container",)) is None
+
+
+class TestBuildHistory(object):
+
+    def test_durations(self, tmp_path):
+        history = BuildHistory(str(tmp_path / "builds.sqlite"))
+        for seconds in [1000, 100, 200, 300, 400, 500]:
+            history.record("python3", seconds)
+        history.record("s2i-core", 60)
+        # Only the latest builds are averaged
+        assert history.get_durations(["python3", "s2i-core", "nodejs"]) == {"python3": 300, "s2i-core": 60}
+        assert BuildHistory(history.path).get_durations(["s2i-core"]) == {"s2i-core": 60}
@@ -71,6 +71,13 @@ class TestCli(object):
         with pytest.raises(AttributeError):
             getattr(c, "foobar_usage")
 
+    @pytest.mark.parametrize("value", ["-1", "two"])
+    def test_max_parallel_builds_invalid(self, value, capsys):
+        parser = Cli(None).get_parser()
+        with pytest.raises(SystemExit):
+            parser.parse_args(["build", "core", "--max-parallel-builds", value])
+        assert "--max-parallel-builds" in capsys.readouterr().err
+
     def test_common_arguments(self):
         c = Cli(None)
         cli_usage = c.cli_usage()
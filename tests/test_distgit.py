@@ -25,6 +25,7 @@ import pytest
 import shutil
 
 from flexmock import flexmock
+from git import Repo
 from pathlib import Path
 
 from container_workflow_tool.cli import ImageRebuilder
@@ -80,3 +81,65 @@ class TestDistgit(object):
         self.ir.distgit._clone_downstream(self.component, "main")
         self.ir.dist_git_merge_changes()
         shutil.rmtree(tmp / self.component)
+
+
+class TestCloneDownstream(object):
+    def setup_method(self):
+        self.ir = ImageRebuilder('Testing')
+        self.ir.set_config('default.yaml', release="rawhide")
+
+    def _images(self, components):
+        return [{"component": c, "git_branch": "main"} for c in components]
+
+    def test_clone_downstreams(self, distgit_remote, tmp_path, monkeypatch, caplog):
+        for component in ["s2i-core", "s2i-base", "python3"]:
+            distgit_remote(component)
+        self.ir.conf["hostname_url"] = distgit_remote.url
+        self.ir.conf["clone_workers"] = 2
+        monkeypatch.chdir(tmp_path)
+        os.mkdir("s2i-core")
+        Repo.init("s2i-core")
+        images = self._images(["s2i-core", "s2i-base", "missing", "python3", "s2i-base"])
+        caplog.clear()
+        repos = self.ir.distgit.clone_downstreams(images)
+        assert sorted(repos) == ["python3", "s2i-base", "s2i-core"]
+        assert repos["s2i-base"].active_branch.name == "main"
+        assert (tmp_path / "python3" / "Dockerfile").is_file()
+        progress = [r.getMessage() for r in caplog.records if r.getMessage().startswith("[")]
+        assert progress[0] == "[1/4] s2i-core: using existing repo"
+        assert progress[1] == "[2/4] s2i-base: cloned"
+        assert progress[2].startswith("[3/4] missing: git failed to clone missing")
+        assert progress[3] == "[4/4] python3: cloned"
+
+    def _commit(self, repo, content):
+        (Path(repo.working_dir) / "Dockerfile").write_text(content)
+        repo.index.add(["Dockerfile"])
+        return repo.index.commit(content).hexsha
+
+    def test_update_downstreams(self, distgit_remote, tmp_path, monkeypatch, caplog):
+        remotes = {c: distgit_remote(c) for c in ["s2i-core", "s2i-base", "python3"]}
+        for remote in remotes.values():
+            remote.git.branch("future")
+        self.ir.conf["hostname_url"] = distgit_remote.url
+        monkeypatch.chdir(tmp_path)
+        images = [dict(image, git_future="future") for image in self._images(remotes)]
+        repos = self.ir.distgit.clone_downstreams(images)
+        repos["s2i-core"].git.branch("future", "origin/future")
+        # New commits upstream, s2i-base also has a local commit diverging from them
+        new = self._commit(remotes["s2i-core"], "FROM fedora:40\n")
+        remotes["s2i-core"].git.branch("-f", "future", new)
+        self._commit(remotes["s2i-base"], "FROM fedora:40\n")
+        self._commit(repos["s2i-base"], "FROM fedora:39\n")
+        caplog.clear()
+        repos = self.ir.distgit.clone_downstreams(images, update=True)
+        assert repos["s2i-core"].head.commit.hexsha == new
+        assert repos["s2i-core"].heads.future.commit.hexsha == new
+        assert (tmp_path / "s2i-core" / "Dockerfile").read_text() == "FROM fedora:40\n"
+        assert (tmp_path / "s2i-base" / "Dockerfile").read_text() == "FROM fedora:39\n"
+        progress = [r.getMessage() for r in caplog.records if r.getMessage().startswith("[")]
+        assert progress == [
+            "[1/3] s2i-core: updated main, future",
+            "[2/3] s2i-base: not updated main",
+            "[3/3] python3: up to date",
+        ]
+        assert "s2i-base: branch main diverged from origin, not updating it" in caplog.text
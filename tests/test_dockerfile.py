@@ -58,3 +58,35 @@ class TestDockerfile:
     def test_set_from_wrong_get_from(self):
         fdata = "FROM \nSOMETHING"
         assert self.dfh.set_from(fdata, from_tag="dummy") == fdata
+
+    def test_get_froms(self):
+        fdata = ("FROM quay.io/fedora/s2i-core:37 AS builder\nRUN make\n"
+                 "FROM --platform=linux/amd64 quay.io/fedora/s2i-base:37\nCOPY --from=builder /a /b\n"
+                 "FROM builder\n")
+        assert self.dfh.get_froms(fdata) == ["quay.io/fedora/s2i-core:37", "quay.io/fedora/s2i-base:37"]
+
+    @pytest.mark.parametrize(
+        "fdata,expected_name",
+        [
+            ('ENV NAME=s2i-base \\\n    VERSION=1\nLABEL summary="$NAME" \\\n      name="$FGC/$NAME"\n',
+             "/s2i-base"),
+            ('ENV FGC f37\nARG NAME=s2i-core\nLABEL name="${FGC}/${NAME}"\n', "f37/s2i-core"),
+            ("LABEL name=fedora/python3\n", "fedora/python3"),
+            ("FROM fedora:37\n", None),
+        ]
+    )
+    def test_get_name(self, fdata, expected_name):
+        assert self.dfh.get_name(fdata) == expected_name
+
+    def test_get_build_graph(self, tmp_path):
+        dockerfiles = {
+            "s2i-core": 'FROM registry.fedoraproject.org/fedora:37\nENV NAME=s2i-core\nLABEL name="$FGC/$NAME"\n',
+            "s2i-base": 'FROM registry.fedoraproject.org/f37/s2i-core:latest\nLABEL name="f37/s2i-base"\n',
+            "python3": "FROM registry.fedoraproject.org/f37/s2i-base:latest\n",
+        }
+        for component, fdata in dockerfiles.items():
+            (tmp_path / component).mkdir()
+            (tmp_path / component / "Dockerfile").write_text(fdata)
+        images = [{"component": c, "name": c} for c in list(dockerfiles) + ["missing"]]
+        graph = self.dfh.get_build_graph(images, str(tmp_path))
+        assert graph == {"s2i-core": [], "s2i-base": ["s2i-core"], "python3": ["s2i-base"]}
@@ -21,6 +21,7 @@
 # SOFTWARE.
 
 import os
+import hashlib
 import pytest
 import shutil
 from pathlib import Path
@@ -96,3 +97,81 @@ class TestGitOperations:
         fixed = self.ir.git_ops.update_variable_in_string(fdata=yaml_file, tag=tag, tag_str=tag_str, variable=variable)
         result = f"{tag}: \"{variable}\"" in fixed
         assert result == expected
+
+    def test_clone_upstream_mirror(self, distgit_remote, tmp_path, cache_home):
+        upstream = distgit_remote("s2i")
+        url = Path(upstream.working_dir).as_uri()
+        git_ops = self.ir.git_ops
+        repo = git_ops.clone_upstream(url, str(tmp_path / "first"))
+        assert repo.remote().url == url
+        mirror = Path(cache_home) / "cwt" / "mirrors" / (hashlib.sha1(url.encode()).hexdigest() + ".git")
+        assert mirror.is_dir()
+        # A later run gets the new commits through the mirror
+        (Path(upstream.working_dir) / "README.md").write_text("new")
+        upstream.index.add(["README.md"])
+        new = upstream.index.commit("Add README").hexsha
+        repo = git_ops.clone_upstream(url, str(tmp_path / "second"))
+        assert repo.head.commit.hexsha == new
+        assert mirror.is_dir()
+
+    def test_clone_upstream_without_mirror(self, distgit_remote, tmp_path, cache_home):
+        url = Path(distgit_remote("s2i").working_dir).as_uri()
+        self.ir.conf["mirror_upstreams"] = False
+        repo = self.ir.git_ops.clone_upstream(url, str(tmp_path / "s2i"))
+        assert repo.remote().url == url
+        mirror = Path(cache_home) / "cwt" / "mirrors" / (hashlib.sha1(url.encode()).hexdigest() + ".git")
+        assert not mirror.exists()
+
+    def test_clone_upstream_once(self, distgit_remote, tmp_path):
+        url = Path(distgit_remote("s2i").working_dir).as_uri()
+        count = tmp_path / "count"
+        commands = {1: f"echo generated >> {count}"}
+        git_ops = self.ir.git_ops
+        first = git_ops.clone_upstream(url, str(tmp_path / "s2i"), commands=commands)
+        assert git_ops.clone_upstream(url, str(tmp_path / "s2i"), commands=dict(commands)) is first
+        assert count.read_text().count("generated") == 1
+        # Other commands are still run
+        git_ops.clone_upstream(url, str(tmp_path / "s2i"), commands={1: f"echo other >> {count}"})
+        assert count.read_text().count("other") == 1
+        git_ops.forget_upstreams()
+        git_ops.clone_upstream(url, str(tmp_path / "s2i"), commands=commands)
+        assert count.read_text().count("generated") == 2
+
+    def test_clone_upstream_sparse(self, distgit_remote, tmp_path):
+        upstream = distgit_remote("s2i")
+        root = Path(upstream.working_dir)
+        for path in ["3.9/Dockerfile", "3.8/Dockerfile", "test/run", "common/root/file", "shared/file", "docs/x"]:
+            (root / path).parent.mkdir(parents=True, exist_ok=True)
+            (root / path).write_text(path)
+        # Symlinks pointing outside of the synced directory, also through another symlink
+        os.symlink("../test", root / "3.9" / "test")
+        os.symlink("../common/root", root / "3.9" / "root")
+        os.symlink("../../shared/file", root / "common" / "root" / "shared")
+        upstream.git.add(".")
+        upstream.index.commit("Add versions")
+        upstream.git.config("uploadpack.allowFilter", "true")
+        url = root.as_uri()
+        self.ir.conf["upstream_sparse"] = True
+        self.ir.conf["upstream_depth"] = 1
+        self.ir.conf["upstream_filter"] = "blob:none"
+        git_ops = self.ir.git_ops
+        ups_path = tmp_path / "s2i"
+        repo = git_ops.clone_upstream(url, str(ups_path), paths=["3.9"])
+        assert len(list(repo.iter_commits())) == 1
+        assert (ups_path / "3.9" / "test" / "run").is_file()
+        assert (ups_path / "3.9" / "root" / "shared").read_text() == "shared/file"
+        assert (ups_path / "Dockerfile").is_file()
+        assert not (ups_path / "3.8").exists()
+        assert not (ups_path / "docs").exists()
+        # Another image of the upstream extends the checkout
+        git_ops.clone_upstream(url, str(ups_path), paths=["3.8"])
+        assert (ups_path / "3.8" / "Dockerfile").is_file()
+        assert (ups_path / "3.9" / "Dockerfile").is_file()
+
+    def test_get_upstream_paths(self):
+        images = [
+            {"name": "s2i-core", "git_path": "core"},
+            {"name": "s2i-base", "git_path": "base"},
+            {"name": "python-39", "git_path": "3.9"},
+        ]
+        assert self.ir.git_ops.get_upstream_paths(images) == {"s2i": ["base", "core"], "python": ["3.9"]}
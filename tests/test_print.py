@@ -21,6 +21,9 @@
 # SOFTWARE.
 
 import os
+import sys
+import json
+import logging
 
 from flexmock import flexmock
 
@@ -49,27 +52,18 @@ class TestRebuilderPrinter(object):
                           brewapi_get_buildinfo_python3, brewapi_list_archives_s2i_base,
                           brewapi_list_archives_s2i_core, brewapi_list_archives_python3):
         flexmock(KojiAPI).should_receive("get_nvrs").and_return(brewapi_get_nvrs)
-        flexmock(KojiAPI).should_receive("get_buildinfo").\
-            with_args("s2i-core-0-51.container").\
-            and_return(brewapi_get_buildinfo_s2i_core)
-        flexmock(KojiAPI).should_receive("get_buildinfo").\
-            with_args("s2i-base-1-63.container").\
-            and_return(brewapi_get_buildinfo_s2i_base)
-        flexmock(KojiAPI).should_receive("get_buildinfo").\
-            with_args("python3-0-31.container").\
-            and_return(brewapi_get_buildinfo_python3)
-        flexmock(KojiAPI).should_receive("get_listarchives").\
-            with_args(brewapi_get_buildinfo_s2i_core["build_id"]).\
-            and_return([brewapi_list_archives_s2i_core])
-        flexmock(KojiAPI).should_receive("get_listarchives").\
-            with_args(brewapi_get_buildinfo_s2i_base["build_id"]).\
-            and_return([brewapi_list_archives_s2i_base])
-        flexmock(KojiAPI).should_receive("get_listarchives").\
-            with_args(brewapi_get_buildinfo_python3["build_id"]).\
-            and_return([brewapi_list_archives_python3])
+        flexmock(KojiAPI).should_receive("get_buildinfo_batch").\
+            with_args(["s2i-core-0-51.container", "s2i-base-1-63.container", "python3-0-31.container"]).\
+            and_return([brewapi_get_buildinfo_s2i_core, brewapi_get_buildinfo_s2i_base,
+                        brewapi_get_buildinfo_python3])
+        flexmock(KojiAPI).should_receive("get_listarchives_batch").\
+            with_args([brewapi_get_buildinfo_s2i_core["build_id"], brewapi_get_buildinfo_s2i_base["build_id"],
+                       brewapi_get_buildinfo_python3["build_id"]]).\
+            and_return([[brewapi_list_archives_s2i_core], [brewapi_list_archives_s2i_base],
+                        [brewapi_list_archives_python3]])
         self.ir = ImageRebuilder("Testing")
         self.ir.set_config("f34.yaml", release="fedora34")
-        output = self.ir.get_brew_builds(print_time=False)
+        output = list(self.ir.get_brew_builds(print_time=False))
         expected_output = [
             "||Component||Build||Image_name||Archives||",
             "|s2i-core|s2i-core-0-51.container|f34/s2i-core:0-51.container|1",
@@ -77,3 +71,91 @@ class TestRebuilderPrinter(object):
             "|python3|python3-0-31.container|f34/python3:0-31.container|1"
         ]
         assert output == expected_output
+
+    def test_hashids(self, capsys, tmp_path, brewapi_get_nvrs, brewapi_get_buildinfo_s2i_base,
+                     brewapi_get_buildinfo_s2i_core, brewapi_get_buildinfo_python3, brewapi_list_archives_s2i_base,
+                     brewapi_list_archives_s2i_core, brewapi_list_archives_python3):
+        flexmock(KojiAPI).should_receive("get_nvrs").and_return(brewapi_get_nvrs)
+        flexmock(KojiAPI).should_receive("get_buildinfo_batch").\
+            and_return([brewapi_get_buildinfo_s2i_core, brewapi_get_buildinfo_s2i_base,
+                        brewapi_get_buildinfo_python3])
+        flexmock(KojiAPI).should_receive("get_listarchives_batch").\
+            and_return([[brewapi_list_archives_s2i_core], [brewapi_list_archives_s2i_base],
+                        [brewapi_list_archives_python3]]).once()
+        hashids = self.ir.get_hash_ids()
+        assert [(h["component"], h["arch"]) for h in hashids] == [
+            ("s2i-core", "x86_64"), ("s2i-base", "x86_64"), ("python3", "x86_64")
+        ]
+        assert hashids[1]["hash_id"] == brewapi_list_archives_s2i_base["extra"]["docker"]["id"]
+        assert hashids[1]["digest"] == "sha256:1f17edbfca1aa2d7c3136a8af13da032d294699a706127ed1b38bee8248ce6db"
+
+        def get_hash_ids():
+            self.ir.logger.info("Fetching info from Brew... (0/3)")
+            return hashids
+        flexmock(ImageRebuilder).should_receive("get_hash_ids").replace_with(get_hash_ids)
+        # Like the handlers printing log messages to stdout
+        handler = logging.StreamHandler(sys.stdout)
+        self.ir.logger.addHandler(handler)
+        self.ir.output_format = "csv"
+        self.ir.print_hash_ids()
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[0] == "component,nvr,arch,hash_id,digest"
+        assert lines[2].startswith("s2i-base,s2i-base-1-63.container,x86_64,sha256:")
+        self.ir.output_format = "json"
+        self.ir.print_hash_ids()
+        assert json.loads(capsys.readouterr().out) == hashids
+        # The output file contains only the document, without the log messages
+        self.ir.output_file = str(tmp_path / "hashids.json")
+        self.ir.setup_log_to_file()
+        self.ir.print_hash_ids()
+        with open(self.ir.output_file) as f:
+            assert json.load(f) == hashids
+        self.ir.logger.removeHandler(handler)
+
+    def test_latestbase(self, brewapi_get_nvrs, brewapi_get_buildinfo_s2i_base, brewapi_get_buildinfo_s2i_core,
+                        brewapi_get_buildinfo_python3, brewapi_list_archives_s2i_base,
+                        brewapi_list_archives_s2i_core, brewapi_list_archives_python3):
+        flexmock(KojiAPI).should_receive("get_nvrs").and_return(brewapi_get_nvrs)
+        flexmock(KojiAPI).should_receive("get_buildinfo_batch").\
+            and_return([brewapi_get_buildinfo_s2i_core, brewapi_get_buildinfo_s2i_base,
+                        brewapi_get_buildinfo_python3])
+        flexmock(KojiAPI).should_receive("get_listarchives_batch").\
+            and_return([[brewapi_list_archives_s2i_core], [brewapi_list_archives_s2i_base],
+                        [brewapi_list_archives_python3]])
+        tag = "f34-container-updates-candidate"
+        # One look-up for every distinct parent
+        flexmock(KojiAPI).should_receive("_latest_builds").\
+            with_args([(tag, "s2i-core"), (tag, "s2i-base")]).\
+            and_return([[{"nvr": "s2i-core-0-51.container"}], [{"nvr": "s2i-base-1-63.container"}]]).once()
+        self.ir.set_do_images(None)
+        output = list(self.ir.get_latest_base())
+        assert output == [
+            "||Component||Build||Base image||Latest base image||Status||",
+            "|s2i-core|s2i-core-0-51.container|None|None|unknown|",
+            "|s2i-base|s2i-base-1-63.container|s2i-core-0-51.container|s2i-core-0-51.container|latest|",
+            "|python3|python3-0-31.container|s2i-base-1-60.container|s2i-base-1-63.container|outdated|",
+            "1 builds are not built on the latest base image.",
+        ]
+        # Repeated look-ups are memoized
+        assert list(self.ir.get_latest_base()) == output
+
+    def test_buildgraph(self, caplog, tmp_path):
+        dockerfiles = {
+            "s2i-core": "FROM registry.fedoraproject.org/fedora:34\nLABEL name=f34/s2i-core\n",
+            "s2i-base": "FROM registry.fedoraproject.org/f34/s2i-core:latest\n",
+            "python3": "FROM registry.fedoraproject.org/f34/s2i-base:latest\n",
+        }
+        for component, fdata in dockerfiles.items():
+            (tmp_path / component).mkdir()
+            (tmp_path / component / "Dockerfile").write_text(fdata)
+        self.ir.set_tmp_workdir(str(tmp_path))
+        self.ir.set_do_images(["s2i-core", "s2i-base", "python3", "nodejs"])
+        caplog.clear()
+        self.ir.print_build_graph()
+        assert [r.getMessage() for r in caplog.records] == [
+            "s2i-core <- base image",
+            "s2i-base <- s2i-core",
+            "nodejs: Dockerfile not found",
+            "python3 <- s2i-base",
+            "Critical path: s2i-core -> s2i-base -> python3",
+        ]
@@ -21,10 +21,16 @@
 # SOFTWARE.
 
 import pytest
+import shutil
+from pathlib import Path
 
+from flexmock import flexmock
+from git import Repo
 
 from container_workflow_tool.utility import RebuilderError
 from container_workflow_tool.cli import ImageRebuilder
+from container_workflow_tool.koji import KojiAPI
+from container_workflow_tool.scheduler import Build
 
 
 class TestRebuilder(object):
@@ -46,6 +52,16 @@ class TestRebuilder(object):
         self.ir.set_config("f34.yaml", release="fedora34")
         assert self.ir.conf.releases["fedora"]["current"] == "34"
 
+    def test_set_config_negative_max_parallel(self, tmp_path):
+        config_dir = Path(self.ir._get_config_path(""))
+        shutil.copytree(config_dir / "share", tmp_path / "share")
+        cwt_config = (config_dir / "share" / "cwt_config.yaml").read_text()
+        (tmp_path / "share" / "cwt_config.yaml").write_text(
+            cwt_config.replace("max_parallel_builds: 0", "max_parallel_builds: -1"))
+        shutil.copy(config_dir / "default.yaml", tmp_path)
+        with pytest.raises(RebuilderError, match="max_parallel_builds"):
+            self.ir.set_config(str(tmp_path / "default.yaml"), release="rawhide")
+
     def test_do_images(self):
         self.ir.set_do_images("s2i-base")
         images = [i["component"] for i in self.ir._get_images()]
@@ -80,6 +96,26 @@ class TestRebuilder(object):
         # Do not delete /tmp
         self.ir.tmp_workdir = None
 
+    def test_get_unchanged(self, tmp_path):
+        heads = {}
+        for component in ["s2i-core", "s2i-base", "python3"]:
+            repo = Repo.init(tmp_path / component)
+            repo.index.commit("Initial commit")
+            heads[component] = repo.head.commit.hexsha
+        images = [{"component": c, "build_tag": "tag"} for c in heads]
+        built = {"s2i-core": heads["s2i-core"], "s2i-base": "0" * 40, "python3": None}
+        flexmock(KojiAPI).should_receive("get_source_commits").with_args(images).and_return(built).once()
+        self.ir.set_tmp_workdir(str(tmp_path))
+        assert self.ir._get_unchanged(images) == ["s2i-core"]
+
+    def test_triggered_not_cloned(self, tmp_path, caplog):
+        build = Build({"component": "s2i-core", "trigger": "layer"})
+        images = [{"component": "s2i-base"}]
+        flexmock(self.ir).should_receive("_get_set_from_config").with_args("layer").and_return(images)
+        self.ir.set_tmp_workdir(str(tmp_path))
+        assert self.ir._get_triggered_images(build) == []
+        assert f"Cannot build images triggered by s2i-core: {tmp_path / 's2i-base'}" in caplog.text
+
     def test_set_repo_url(self):
         url = "url"
         self.ir.set_repo_url(url)
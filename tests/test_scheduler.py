@@ -0,0 +1,449 @@
+# MIT License
+#
+# Copyright (c) 2023 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import json
+import logging
+import time
+
+import pytest
+
+from container_workflow_tool.koji import TASK_OPEN, TASK_CLOSED, TASK_FAILED
+from container_workflow_tool.cache import BuildHistory
+from container_workflow_tool.scheduler import Build, BuildJournal, BuildScheduler, RetryPolicy, longest_chain
+
+
+def max_running(builds):
+    """Returns the highest number of builds that were running at once"""
+    return max(sum(1 for b in builds if b.started <= s.started < b.finished) for s in builds)
+
+
+class TestBuildScheduler(object):
+
+    def _scheduler(self, fake_packager, **kwargs):
+        scheduler = BuildScheduler(fake_packager.packager, fake_packager.workdir, **kwargs)
+        scheduler.poll_interval = 0.05
+        return scheduler
+
+    def test_unlimited(self, fake_packager):
+        images = [fake_packager(f"image{i}", build_time=0.3) for i in range(4)]
+        builds = self._scheduler(fake_packager).run(images)
+        assert sorted(b.component for b in builds) == [f"image{i}" for i in range(4)]
+        assert max_running(builds) == 4
+        assert all(b.succeeded for b in builds)
+        assert all(isinstance(b.task_id, int) for b in builds)
+
+    def test_max_parallel(self, fake_packager):
+        images = [fake_packager(f"image{i}", build_time=0.2) for i in range(5)]
+        builds = self._scheduler(fake_packager, max_parallel=2).run(images)
+        assert len(builds) == 5
+        assert max_running(builds) == 2
+        # Queued builds waited for a free slot
+        assert builds[-1].queue_wait >= 0.2
+
+    def test_slot_reused_immediately(self, fake_packager):
+        images = [fake_packager("slow", build_time=1), fake_packager("fast", build_time=0.1),
+                  fake_packager("next", build_time=0.1)]
+        builds = {b.component: b for b in self._scheduler(fake_packager, max_parallel=2).run(images)}
+        # The queued build does not wait for the slow one
+        assert builds["next"].started < builds["slow"].finished
+
+    def test_failure(self, fake_packager):
+        images = [fake_packager("good"), fake_packager("bad", exit_code=1, stderr="Build failed")]
+        builds = {b.component: b for b in self._scheduler(fake_packager).run(images)}
+        assert builds["good"].succeeded
+        assert not builds["bad"].succeeded
+        assert builds["bad"].returncode == 1
+
+    def test_end_noticed_immediately(self, fake_packager):
+        images = [fake_packager("slow", build_time=1), fake_packager("fast", build_time=0.1)]
+        scheduler = BuildScheduler(fake_packager.packager, fake_packager.workdir)
+        start = time.time()
+        builds = scheduler.run(images)
+        assert time.time() - start < scheduler.poll_interval
+        assert [b.component for b in builds] == ["fast", "slow"]
+        assert builds[0].duration < 1
+
+    def test_output_drained(self, fake_packager):
+        image = fake_packager("image", stderr="x" * 200000 + "last line")
+        scheduler = self._scheduler(fake_packager)
+        build, = scheduler.run([image])
+        assert build.succeeded
+        assert build.stderr.endswith(b"last line")
+        assert len(build.stderr) == scheduler.tail_size
+        log = open(os.path.join(fake_packager.workdir, "logs", "image.log")).read()
+        assert "taskID" in log
+        assert log.endswith("x" * 200000 + "last line")
+
+    def test_reap_exited(self, fake_packager):
+        # Reaped without the selector noticing the output first,
+        # the output fits into the pipe but takes several reads
+        image = fake_packager("image", stderr="x" * 3000 + "last line")
+        scheduler = self._scheduler(fake_packager)
+        scheduler.read_size = 256
+        build = Build(image)
+        scheduler._start(build)
+        build.proc.wait()
+        scheduler._finish(build)
+        assert build.succeeded
+        assert not build.streams
+        log = open(os.path.join(fake_packager.workdir, "logs", "image.log")).read()
+        assert log.endswith("x" * 3000 + "last line")
+
+    def test_triggered(self, fake_packager):
+        images = [fake_packager("base", build_time=0.2), fake_packager("other", build_time=1)]
+        layers = {"base": [fake_packager("core", build_time=0.2)],
+                  "core": [fake_packager("s2i", build_time=0.2)]}
+        builds = self._scheduler(fake_packager, max_parallel=2).run(
+            images, triggered=lambda build: layers.get(build.component, []))
+        builds = {b.component: b for b in builds}
+        assert set(builds) == {"base", "other", "core", "s2i"}
+        # Dependent layers do not wait for the unrelated build
+        assert builds["s2i"].finished < builds["other"].finished
+        assert [b.component for b in builds["s2i"].chain] == ["base", "core", "s2i"]
+
+    def test_unchanged(self, fake_packager):
+        images = [fake_packager("base", exit_code=1), fake_packager("other")]
+        layers = {"base": [fake_packager("core", exit_code=1), fake_packager("python")],
+                  "core": [fake_packager("s2i")]}
+        checked = []
+
+        def unchanged(images):
+            checked.append([image["component"] for image in images])
+            return ["base", "core"]
+        builds = {b.component: b for b in self._scheduler(fake_packager).run(
+            images, triggered=lambda build: layers.get(build.component, []), unchanged=unchanged)}
+        # Unchanged images are not built, but still trigger their layers
+        assert sorted(builds) == ["base", "core", "other", "python", "s2i"]
+        assert all(b.succeeded for b in builds.values())
+        assert builds["base"].proc is None and builds["core"].proc is None
+        assert builds["python"].proc is not None
+        assert checked == [["base", "other"], ["core", "python"], ["s2i"]]
+
+    def test_not_triggered_on_failure(self, fake_packager):
+        images = [fake_packager("base", exit_code=1)]
+        builds = self._scheduler(fake_packager).run(
+            images, triggered=lambda build: [fake_packager("core")])
+        assert [b.component for b in builds] == ["base"]
+
+    def test_report(self, fake_packager, caplog):
+        images = [fake_packager("base", build_time=0.2), fake_packager("other")]
+        layers = {"base": [fake_packager("core")]}
+        scheduler = self._scheduler(fake_packager)
+        builds = scheduler.run(images, triggered=lambda build: layers.get(build.component, []))
+        caplog.clear()
+        with caplog.at_level(logging.INFO):
+            scheduler.report(builds)
+        lines = [r.getMessage().strip() for r in caplog.records]
+        assert lines[0].startswith("Built 3 images in")
+        assert lines[1] == "Critical path:"
+        assert [line.split(":")[0] for line in lines[2:]] == ["base", "core"]
+
+    def test_graph(self, fake_packager):
+        images = [fake_packager("s2i", build_time=0.1), fake_packager("core", build_time=0.1),
+                  fake_packager("base", build_time=0.3), fake_packager("other", build_time=0.1)]
+        graph = {"s2i": ["core"], "core": ["base"], "base": [], "other": []}
+        builds = self._scheduler(fake_packager).run(images, graph=graph)
+        builds = {b.component: b for b in builds}
+        assert builds["core"].started >= builds["base"].finished
+        assert builds["s2i"].started >= builds["core"].finished
+        assert builds["other"].finished < builds["base"].finished
+        assert [b.component for b in builds["s2i"].chain] == ["base", "core", "s2i"]
+
+    def test_graph_failed_parent(self, fake_packager):
+        images = [fake_packager("base", exit_code=1), fake_packager("core"), fake_packager("s2i")]
+        graph = {"s2i": ["core"], "core": ["base"]}
+        builds = self._scheduler(fake_packager).run(images, graph=graph)
+        assert [b.component for b in builds] == ["base"]
+
+    def test_graph_cycle(self, fake_packager):
+        images = [fake_packager("a"), fake_packager("b")]
+        builds = self._scheduler(fake_packager).run(images, graph={"a": ["b"], "b": ["a"]})
+        assert sorted(b.component for b in builds) == ["a", "b"]
+
+
+@pytest.mark.parametrize(
+    "graph,expected",
+    [
+        ({}, []),
+        ({"a": [], "b": []}, ["a"]),
+        ({"s2i": ["core"], "core": ["base"], "base": [], "other": ["base"]}, ["base", "core", "s2i"]),
+        ({"a": ["b"], "b": ["a"]}, ["b", "a"]),
+    ]
+)
+def test_longest_chain(graph, expected):
+    assert longest_chain(graph) == expected
+
+
+class TestDurations(object):
+
+    def _scheduler(self, fake_packager, durations, **kwargs):
+        scheduler = BuildScheduler(fake_packager.packager, fake_packager.workdir, durations=durations, **kwargs)
+        scheduler.poll_interval = 0.05
+        return scheduler
+
+    def test_longest_first(self, fake_packager):
+        images = [fake_packager(c) for c in ["s2i-core", "nodejs", "unknown", "python3"]]
+        durations = {"s2i-core": 100, "nodejs": 900, "python3": 600}
+        builds = self._scheduler(fake_packager, durations, max_parallel=1).run(images)
+        assert [b.component for b in builds] == ["nodejs", "python3", "unknown", "s2i-core"]
+
+    def test_longest_first_graph(self, fake_packager):
+        images = [fake_packager(c) for c in ["base", "core", "s2i"]]
+        durations = {"base": 10, "core": 20, "s2i": 30}
+        graph = {"s2i": ["core"], "core": ["base"]}
+        builds = self._scheduler(fake_packager, durations, max_parallel=1).run(images, graph=graph)
+        assert [b.component for b in builds] == ["base", "core", "s2i"]
+
+    def test_history(self, fake_packager, tmp_path):
+        history = BuildHistory(str(tmp_path / "builds.sqlite"))
+        images = [fake_packager("good", build_time=0.2), fake_packager("bad", exit_code=1)]
+        self._scheduler(fake_packager, {}, history=history).run(images)
+        durations = history.get_durations(["good", "bad"])
+        assert list(durations) == ["good"]
+        assert durations["good"] >= 0.2
+
+    @pytest.mark.parametrize(
+        "max_parallel,graph,expected",
+        [
+            (0, None, 400),
+            (1, None, 1000),
+            (2, None, 500),
+            (2, {"s2i": ["core"], "core": ["base"]}, 600),
+            (0, {"other": ["s2i"], "s2i": ["core"], "core": ["base"]}, 1000),
+        ]
+    )
+    def test_estimate(self, fake_packager, max_parallel, graph, expected):
+        durations = {"base": 100, "core": 200, "s2i": 300, "other": 400}
+        scheduler = self._scheduler(fake_packager, durations, max_parallel=max_parallel)
+        builds = [Build({"component": c}) for c in durations]
+        now = time.time()
+        end = scheduler.estimate(builds, [], builds, graph)
+        assert end - now == pytest.approx(expected, abs=1)
+
+    def test_estimate_running(self, fake_packager):
+        scheduler = self._scheduler(fake_packager, {"base": 100, "core": 200}, max_parallel=1)
+        base, core = Build({"component": "base"}), Build({"component": "core"})
+        base.started = time.time() - 60
+        now = time.time()
+        end = scheduler.estimate([core], [base], [base, core], {"core": ["base"]})
+        assert end - now == pytest.approx(240, abs=1)
+
+
+class TestRetry(object):
+
+    def _scheduler(self, fake_packager, max_attempts=3):
+        retry = RetryPolicy(max_attempts=max_attempts, delay=0.1, patterns=["Connection reset"])
+        scheduler = BuildScheduler(fake_packager.packager, fake_packager.workdir, retry=retry)
+        scheduler.poll_interval = 0.05
+        return scheduler
+
+    def test_policy(self):
+        retry = RetryPolicy(max_attempts=3, delay=10, patterns=["[Tt]imed? ?out", "50[234] "])
+        assert retry.is_transient("error: Read timed out")
+        assert retry.is_transient("HTTP 503 Service Unavailable")
+        assert not retry.is_transient("Dockerfile parse error")
+        assert [retry.get_delay(attempt) for attempt in (1, 2, 3)] == [10, 20, 40]
+
+    def test_transient(self, fake_packager):
+        images = [fake_packager("flaky", exit_code=1, stderr="Connection reset by peer"),
+                  fake_packager("broken", exit_code=1, stderr="No such file")]
+        builds = {b.component: b for b in self._scheduler(fake_packager).run(images)}
+        assert builds["flaky"].attempt == 3
+        assert builds["broken"].attempt == 1
+        assert not builds["flaky"].succeeded
+
+    def test_retry_succeeds(self, fake_packager):
+        image = fake_packager("flaky", exit_code=1, stderr="Connection reset by peer")
+        scheduler = self._scheduler(fake_packager)
+        scheduler.packager = os.path.join(fake_packager.workdir, "flaky-packager.sh")
+        with open(scheduler.packager, "w") as f:
+            # Fails on the first attempt only
+            f.write(f"#!/bin/bash\nif [ -e attempted ]; then rm build-exit; fi\ntouch attempted\n"
+                    f"exec {fake_packager.packager} \"$@\"\n")
+        os.chmod(scheduler.packager, 0o755)
+        build, = scheduler.run([image])
+        assert build.succeeded
+        assert build.attempt == 2
+
+    def test_retry_does_not_block(self, fake_packager):
+        images = [fake_packager("flaky", exit_code=1, stderr="Connection reset by peer"),
+                  fake_packager("other", build_time=0.1), fake_packager("next")]
+        scheduler = self._scheduler(fake_packager, max_attempts=2)
+        scheduler.max_parallel = 1
+        builds = scheduler.run(images)
+        # Other images are built while the retry waits for its delay
+        assert [b.component for b in builds] == ["other", "next", "flaky"]
+
+    def test_report(self, fake_packager, caplog):
+        images = [fake_packager("flaky", exit_code=1, stderr="Connection reset by peer")]
+        scheduler = self._scheduler(fake_packager, max_attempts=2)
+        builds = scheduler.run(images)
+        caplog.clear()
+        with caplog.at_level(logging.INFO):
+            scheduler.report(builds)
+        lines = [r.getMessage().strip() for r in caplog.records]
+        assert lines[-2:] == ["Retried builds:", "flaky: failed after 2 attempts"]
+
+
+class FakeKoji(object):
+    """Answers task states, the task ends after the given number of checks
+
+    The first errors checks fail as if the hub could not be reached.
+    """
+
+    def __init__(self, states, checks=1, default=TASK_CLOSED, errors=0):
+        self.states = states
+        self.checks = checks
+        self.default = default
+        self.errors = errors
+        self.calls = []
+
+    def get_task_states(self, task_ids):
+        self.calls.append(task_ids)
+        if len(self.calls) <= self.errors:
+            raise TimeoutError("timed out")
+        if len(self.calls) < self.checks:
+            return {task_id: TASK_OPEN for task_id in task_ids}
+        return {task_id: self.states.get(task_id, self.default) for task_id in task_ids}
+
+
+class TestNowait(object):
+
+    def _scheduler(self, fake_packager, koji):
+        scheduler = BuildScheduler(fake_packager.packager, fake_packager.workdir, koji=koji, nowait=True)
+        scheduler.task_poll_min = 0.05
+        scheduler.task_poll_interval = 0.2
+        return scheduler
+
+    def test_watched(self, fake_packager):
+        # The packager would fail if it waited for the build
+        images = [fake_packager(f"image{i}", build_time=5, exit_code=1) for i in range(3)]
+        koji = FakeKoji({}, checks=3)
+        start = time.time()
+        builds = self._scheduler(fake_packager, koji).run(images)
+        assert time.time() - start < 5
+        assert all(b.succeeded for b in builds)
+        # All tasks are checked together
+        task_ids = sorted(b.task_id for b in builds)
+        assert sorted(koji.calls[-1]) == task_ids
+
+    def test_task_failed(self, fake_packager):
+        images = [fake_packager("image")]
+        build, = self._scheduler(fake_packager, FakeKoji({}, default=TASK_FAILED)).run(images)
+        assert not build.succeeded
+
+    def test_submit_failed(self, fake_packager):
+        image = fake_packager("image")
+        scheduler = self._scheduler(fake_packager, FakeKoji({}))
+        scheduler.packager = "false"
+        build, = scheduler.run([image])
+        assert not build.succeeded
+        assert scheduler.koji.calls == []
+
+    def test_backoff(self, fake_packager):
+        image = fake_packager("image")
+        koji = FakeKoji({}, checks=5)
+        scheduler = self._scheduler(fake_packager, koji)
+        scheduler.run([image])
+        assert len(koji.calls) == 5
+        assert scheduler._task_delay == scheduler.task_poll_min
+
+    def test_hub_error(self, fake_packager, caplog):
+        images = [fake_packager(f"image{i}") for i in range(2)]
+        koji = FakeKoji({}, errors=1)
+        builds = self._scheduler(fake_packager, koji).run(images)
+        assert all(b.succeeded for b in builds)
+        # The failed check is repeated later
+        assert len(koji.calls) >= 2
+        assert "Could not check the state of koji tasks: timed out" in caplog.text
+
+
+class TestBuildJournal(object):
+
+    def _scheduler(self, fake_packager, journal, koji=None):
+        scheduler = BuildScheduler(fake_packager.packager, fake_packager.workdir, journal=journal, koji=koji)
+        scheduler.task_poll_interval = 0.05
+        return scheduler
+
+    def _journal(self, fake_packager, resume=False):
+        return BuildJournal(os.path.join(fake_packager.workdir, "journal.jsonl"), resume=resume)
+
+    def test_record(self, fake_packager):
+        images = [fake_packager("good"), fake_packager("bad", exit_code=1)]
+        journal = self._journal(fake_packager)
+        self._scheduler(fake_packager, journal).run(images)
+        with open(journal.path) as f:
+            entries = [json.loads(line) for line in f]
+        states = [(e["component"], e["state"]) for e in entries]
+        assert states.index(("good", "queued")) < states.index(("good", "submitted"))
+        assert states.index(("good", "submitted")) < states.index(("good", "succeeded"))
+        assert ("bad", "failed") in states
+        assert all(isinstance(e["task_id"], int) for e in entries if e["state"] == "submitted")
+
+    def test_resume(self, fake_packager):
+        images = [fake_packager("good"), fake_packager("bad", exit_code=1)]
+        self._scheduler(fake_packager, self._journal(fake_packager)).run(images)
+        fake_packager("bad", exit_code=0)
+        journal = self._journal(fake_packager, resume=True)
+        builds = {b.component: b for b in self._scheduler(fake_packager, journal).run(images)}
+        assert builds["good"].resumed and builds["good"].proc is None
+        assert builds["bad"].succeeded and builds["bad"].proc is not None
+        # A fresh run forgets the previous one
+        assert self._journal(fake_packager).get("good") is None
+
+    def test_resume_triggered(self, fake_packager):
+        images = [fake_packager("base")]
+        layers = {"base": [fake_packager("core")]}
+        self._scheduler(fake_packager, self._journal(fake_packager)).run(
+            images, triggered=lambda build: layers.get(build.component, []))
+        journal = self._journal(fake_packager, resume=True)
+        builds = self._scheduler(fake_packager, journal).run(
+            images, triggered=lambda build: layers.get(build.component, []))
+        assert [(b.component, b.resumed) for b in builds] == [("base", True), ("core", True)]
+
+    def test_resume_twice(self, fake_packager):
+        images = [fake_packager("built"), fake_packager("submitted")]
+        with open(os.path.join(fake_packager.workdir, "journal.jsonl"), "w") as f:
+            f.write('{"component": "built", "state": "succeeded", "task_id": 41}\n')
+            f.write('{"component": "submitted", "state": "submitted", "task_id": 42}\n')
+        scheduler = self._scheduler(fake_packager, self._journal(fake_packager, resume=True))
+        # Interrupted before the queued builds were launched
+        scheduler._queue([], [], [Build(image) for image in images])
+        journal = self._journal(fake_packager, resume=True)
+        assert journal.get("built") == {"component": "built", "state": "succeeded", "task_id": 41}
+        assert journal.get("submitted") == {"component": "submitted", "state": "submitted", "task_id": 42}
+
+    @pytest.mark.parametrize("state,succeeded", [(TASK_CLOSED, True), (TASK_FAILED, False)])
+    def test_resume_submitted(self, fake_packager, state, succeeded):
+        image = fake_packager("image")
+        with open(os.path.join(fake_packager.workdir, "journal.jsonl"), "w") as f:
+            f.write('{"component": "image", "state": "queued", "task_id": null}\n')
+            f.write('{"component": "image", "state": "submitted", "task_id": 42}\n')
+            # Interrupted while writing
+            f.write('{"component": "other", ')
+        journal = self._journal(fake_packager, resume=True)
+        koji = FakeKoji({42: state}, checks=3)
+        build, = self._scheduler(fake_packager, journal, koji).run([image])
+        assert build.proc is None
+        assert build.succeeded == succeeded
+        assert koji.calls == [[42]] * 3
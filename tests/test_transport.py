@@ -0,0 +1,108 @@
+# MIT License
+#
+# Copyright (c) 2023 SCL team at Red Hat
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+import socket
+import threading
+import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+import pytest
+
+from container_workflow_tool.transport import PooledTransport
+
+
+class KeepAliveHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+class TestPooledTransport(object):
+    def setup_method(self):
+        self.server = ThreadingServer(("127.0.0.1", 0), requestHandler=KeepAliveHandler,
+                                      allow_none=True, logRequests=False)
+        self.server.register_function(lambda x: x, "echo")
+        self.server.register_function(lambda s: time.sleep(s), "sleep")
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{}/".format(self.server.server_address[1])
+
+    def teardown_method(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _proxy(self, **kwargs):
+        self.transport = PooledTransport("http", **kwargs)
+        return xmlrpc.client.ServerProxy(self.url, transport=self.transport, allow_none=True)
+
+    def test_keep_alive(self):
+        proxy = self._proxy()
+        for i in range(5):
+            assert proxy.echo(i) == i
+        assert self.transport.requests == 5
+        assert self.transport.connections == 1
+
+    def test_gzip(self):
+        proxy = self._proxy()
+        payload = "x" * 100000
+        assert proxy.echo(payload) == payload
+        # Both directions are compressed
+        assert self.transport.bytes_sent < len(payload)
+        assert self.transport.bytes_received < len(payload)
+
+    def test_concurrent_callers(self):
+        proxy = self._proxy(pool_size=4)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(proxy.echo, range(40)))
+        assert results == list(range(40))
+        assert self.transport.requests == 40
+        assert self.transport.connections <= 4 + 1
+
+    def test_fault(self):
+        proxy = self._proxy()
+        with pytest.raises(xmlrpc.client.Fault):
+            proxy.nonexisting()
+        assert proxy.echo("ok") == "ok"
+        assert self.transport.connections == 1
+
+    def test_projection(self):
+        proxy = self._proxy()
+        builds = [{"nvr": "s2i-base-1-{}.container".format(i), "extra": {"image": {}}, "owner_name": "x"}
+                  for i in range(10)]
+        with self.transport.projection(("nvr",)):
+            assert proxy.echo(builds) == [{"nvr": b["nvr"]} for b in builds]
+            with pytest.raises(xmlrpc.client.Fault):
+                proxy.nonexisting()
+        assert proxy.echo(builds) == builds
+        assert self.transport.thread_bytes_received() == self.transport.bytes_received
+
+    def test_timeout(self):
+        proxy = self._proxy(timeout=0.2)
+        with pytest.raises(socket.timeout):
+            proxy.sleep(1)